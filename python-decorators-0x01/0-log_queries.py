@@ -1,26 +1,304 @@
 import sqlite3
 import functools
+import atexit
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
 from datetime import datetime
 
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query):
+    """
+    Normalize a query so that queries differing only in literal values
+    share a fingerprint, e.g.
+    "SELECT * FROM users WHERE id = 7" -> "select * from users where id = ?"
+    """
+    normalized = _STRING_LITERAL.sub("?", query)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _PLACEHOLDER_LIST.sub("(?+)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip().lower()
+
+
+def print_records(records):
+    """
+    Default sink, writes a batch of records to stdout in one call
+    """
+    lines = []
+    for record in records:
+        timestamp = datetime.fromtimestamp(record['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
+        rows = '-' if record['rows'] is None else record['rows']
+        status = 'SLOW ' if record['slow'] else ''
+        if record['error']:
+            status += f"ERROR {record['error']} "
+        lines.append(f"[{timestamp}] {status}{record['duration_ms']:.2f}ms rows={rows} "
+                     f"query={record['query']} params={record['params']}\n")
+    sys.stdout.write(''.join(lines))
+    sys.stdout.flush()
+
+
+class QueryLog:
+    """
+    In-memory ring buffer of query records, drained to `sink` by a
+    background thread every flush_interval seconds so the decorated call
+    never waits on I/O. When the buffer is full the oldest records are
+    dropped and counted in `dropped`.
+    """
+
+    def __init__(self, capacity=10000, flush_interval=1.0, sink=print_records):
+        self.records = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.sink = sink
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def record(self, entry):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(entry)
+        if self._flusher is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="query-log-flusher", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.records.popleft())
+            except IndexError:
+                break
+        if batch:
+            try:
+                self.sink(batch)
+            except Exception as e:
+                print(f"Query log sink failed: {e}", file=sys.stderr)
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+
+query_log = QueryLog()
+atexit.register(query_log.close)
+
+
+class LatencyHistogram:
+    """
+    Fixed-size histogram of latencies with geometric buckets, each
+    `growth` times wider than the previous, so percentiles are accurate
+    to about (growth - 1) whatever the number of samples
+    """
+
+    def __init__(self, min_ms=0.001, max_ms=100000.0, growth=1.1):
+        self.min_ms = min_ms
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        # bucket 0 holds everything below min_ms, the last one everything above max_ms
+        self.counts = [0] * (int(math.log(max_ms / min_ms) / self._log_growth) + 2)
+        self.total = 0
+
+    def record(self, ms):
+        if ms < self.min_ms:
+            index = 0
+        else:
+            index = min(len(self.counts) - 1, int(math.log(ms / self.min_ms) / self._log_growth) + 1)
+        self.counts[index] += 1
+        self.total += 1
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket holding the p-th percentile (0-100)
+        """
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.min_ms * self.growth ** index
+        return self.min_ms * self.growth ** (len(self.counts) - 1)
+
+
+class QueryStats:
+    """
+    Per-fingerprint aggregates of every decorated query: count, errors,
+    total/mean/max latency, p50/p95/p99 from a LatencyHistogram and rows
+    returned. Memory is fixed: after max_fingerprints distinct
+    fingerprints, new ones are folded into '<other>'.
+    """
+
+    OTHER = '<other>'
+
+    def __init__(self, max_fingerprints=1000):
+        self.max_fingerprints = max_fingerprints
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, query_fingerprint, duration_ms, rows=None, error=False):
+        with self._lock:
+            entry = self._entries.get(query_fingerprint)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    query_fingerprint = self.OTHER
+                    entry = self._entries.get(query_fingerprint)
+                if entry is None:
+                    entry = self._entries[query_fingerprint] = {
+                        'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                        'rows': 0, 'histogram': LatencyHistogram(),
+                    }
+            entry['count'] += 1
+            entry['errors'] += 1 if error else 0
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['rows'] += rows or 0
+            entry['histogram'].record(duration_ms)
+
+    def snapshot(self):
+        """
+        Return {fingerprint: stats} with latencies in milliseconds
+        """
+        with self._lock:
+            result = {}
+            for query_fingerprint, entry in self._entries.items():
+                histogram = entry['histogram']
+                result[query_fingerprint] = {
+                    'count': entry['count'],
+                    'errors': entry['errors'],
+                    'total_ms': entry['total_ms'],
+                    'mean_ms': entry['total_ms'] / entry['count'],
+                    'p50_ms': min(histogram.percentile(50), entry['max_ms']),
+                    'p95_ms': min(histogram.percentile(95), entry['max_ms']),
+                    'p99_ms': min(histogram.percentile(99), entry['max_ms']),
+                    'max_ms': entry['max_ms'],
+                    'rows': entry['rows'],
+                    'mean_rows': entry['rows'] / entry['count'],
+                }
+            return result
+
+    def top(self, n=10, key='total_ms'):
+        """
+        The n hottest fingerprints, by total time unless key says otherwise
+        """
+        return sorted(self.snapshot().items(), key=lambda item: item[1][key], reverse=True)[:n]
+
+    def dump_json(self, path=None):
+        """
+        Return the snapshot as JSON, also writing it to path if given
+        """
+        data = json.dumps(self.snapshot(), indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(data)
+        return data
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+query_stats = QueryStats()
+
+
+def _find_params(args, kwargs):
+    if 'params' in kwargs:
+        return kwargs['params']
+    # a positional tuple/list/dict right after the query is taken as its parameters
+    if len(args) > 1 and isinstance(args[1], (tuple, list, dict)):
+        return args[1]
+    return None
+
+
+def _redact(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: '?' for key in params}
+    return ['?'] * len(params)
+
+
 #### decorator to lof SQL queries
-def log_queries(func):
+def log_queries(func=None, *, sample_rate=1.0, slow_query_ms=None, redact_params=False, log=None, stats=None):
+    """
+    Record every decorated query into a QueryLog instead of printing it.
+
+    Each record holds the query text, its fingerprint, the bound
+    parameters (or placeholders with redact_params=True), the duration
+    and the number of rows returned. Only sample_rate of the calls are
+    recorded, but queries slower than slow_query_ms always are. Every
+    call, sampled or not, is also aggregated per fingerprint into `stats`
+    (query_stats by default).
+    Works bare (@log_queries) or with options (@log_queries(sample_rate=0.1)).
+    """
+    if func is None:
+        return functools.partial(log_queries, sample_rate=sample_rate, slow_query_ms=slow_query_ms,
+                                 redact_params=redact_params, log=log, stats=stats)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         query = None
-        
+
         if 'query' in kwargs:
             query = kwargs['query']
-        # checks if there are positional arg ,and assumes first one might be query    
+        # checks if there are positional arg ,and assumes first one might be query
         elif args and isinstance(args[0], str):
             query = args[0]
-            
-        # Log the SQL query
-        if query:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"Executing SQL query: {query}")
-            
-        return func(*args, **kwargs)
-    
+
+        if not query:
+            return func(*args, **kwargs)
+
+        error = None
+        result = None
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            rows = len(result) if hasattr(result, '__len__') else None
+            query_fingerprint = fingerprint(query)
+            (stats or query_stats).record(query_fingerprint, duration_ms, rows, error is not None)
+
+            slow = slow_query_ms is not None and duration_ms >= slow_query_ms
+            if slow or error or sample_rate >= 1 or random.random() < sample_rate:
+                params = _find_params(args, kwargs)
+                (log or query_log).record({
+                    'timestamp': time.time(),
+                    'query': query,
+                    'fingerprint': query_fingerprint,
+                    'params': _redact(params) if redact_params else params,
+                    'duration_ms': duration_ms,
+                    'rows': rows,
+                    'slow': slow,
+                    'error': error,
+                })
+
     return wrapper
 
 @log_queries
@@ -32,15 +310,18 @@ def fetch_all_users(query):
     conn.close()
     return results
 
-#### fetch users while logging the query
-users = fetch_all_users(query="SELECT * FROM users")
-
-print(f"Number of users found: {len(users)}")
-if users:
-    print("\nUser data:")
-    print("-" * 50)
-    for user in users:
-        print(user)
-        
-else:
-    print("No users found in the database")
\ No newline at end of file
+if __name__ == "__main__":
+    #### fetch users while logging the query
+    users = fetch_all_users(query="SELECT * FROM users")
+
+    print(f"Number of users found: {len(users)}")
+    if users:
+        print("\nUser data:")
+        print("-" * 50)
+        for user in users:
+            print(user)
+
+    else:
+        print("No users found in the database")
+
+    print(query_stats.dump_json())
@@ -1,25 +1,84 @@
 import sqlite3
 import functools
+import inspect
+import sys
+import time
+from db_pool import get_pool, get_async_pool, DB_PATH
+
+def with_db_connection(func=None, *, db_path=None, pool_size=5, idle_timeout=300.0, pre_ping=True,
+                       statement_cache_size=128):
+    """
+    Pass a pooled connection as the first argument of the decorated
+    function and return it to the pool afterwards, instead of opening
+    and closing a connection on every call. Works bare
+    (@with_db_connection) or with options
+    (@with_db_connection(db_path='users.db', pool_size=10)).
+    The pool settings only apply the first time a database is used.
+    Coroutine functions get an aiosqlite connection from an async pool.
+    """
+    if func is None:
+        return functools.partial(with_db_connection, db_path=db_path, pool_size=pool_size,
+                                 idle_timeout=idle_timeout, pre_ping=pre_ping,
+                                 statement_cache_size=statement_cache_size)
+
+    pool_options = {'size': pool_size, 'idle_timeout': idle_timeout, 'pre_ping': pre_ping,
+                    'statement_cache_size': statement_cache_size}
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            async with get_async_pool(db_path or DB_PATH, **pool_options).connection() as conn:
+                return await func(conn, *args, **kwargs)
+        return async_wrapper
 
-def with_db_connection(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect(r'C:\Users\HP\Desktop\decorators\users.db') 
-        try:
-            result = func(conn, *args, **kwargs)
-            return result
-        finally:
-            conn.close()
+        with get_pool(db_path or DB_PATH, **pool_options).connection() as conn:
+            return func(conn, *args, **kwargs)
     return wrapper
-    
-    
+
+
 @with_db_connection
 def get_user_by_id(conn, user_id):
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     return cursor.fetchone()
 
+
+def benchmark(db_path, calls=10000):
+    """
+    Calls per second of a lookup with a new connection per call versus
+    a pooled connection
+    """
+    def connect_per_call(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            conn = sqlite3.connect(db_path)
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                conn.close()
+        return wrapper
+
+    def lookup(conn, user_id):
+        return conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+
+    variants = {
+        'connect per call': connect_per_call(lookup),
+        'pooled': with_db_connection(db_path=db_path)(lookup),
+    }
+    for name, func in variants.items():
+        start = time.perf_counter()
+        for i in range(calls):
+            func(i % 5 + 1)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<17} {calls / elapsed:>10,.0f} calls/sec")
+
 #### Fetch user by ID with automatic connection handling
 
-user = get_user_by_id(user_id=1)
-print(user)
\ No newline at end of file
+if __name__ == "__main__":
+    if '--benchmark' in sys.argv:
+        benchmark(sys.argv[-1] if len(sys.argv) > 2 else DB_PATH)
+    else:
+        user = get_user_by_id(user_id=1)
+        print(user)
@@ -1,26 +1,171 @@
-import sqlite3
+import asyncio
 import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from db_pool import (get_pool, get_async_pool, DB_PATH, track_tables, atrack_tables, database_path,
+                     adatabase_path, notify_commit)
+
+# group_commit() batch active in the current thread, if any
+_local = threading.local()
+
+
+class GroupCommit:
+    """
+    One transaction shared by the transactional calls made inside a
+    group_commit() block. Each call runs in its own savepoint, so a
+    failing call only rolls back its own changes. The batch is committed
+    when the block ends, or earlier once max_calls calls have succeeded
+    or max_delay seconds have passed since its first call.
+    """
+
+    SAVEPOINT = "transactional_call"
+
+    def __init__(self, conn, max_calls=None, max_delay=None):
+        self.conn = conn
+        self.max_calls = max_calls
+        self.max_delay = max_delay
+        self.pending = 0
+        self.calls = 0
+        self.failed = 0
+        self.commits = 0
+        self.written = set()
+        self._started = None
+
+    def run(self, func, args, kwargs):
+        conn = self.conn
+        if not conn.in_transaction:
+            # without an explicit BEGIN, releasing the savepoint would commit
+            conn.execute("BEGIN")
+            self._started = time.monotonic()
+        conn.execute(f"SAVEPOINT {self.SAVEPOINT}")
+        try:
+            with track_tables(conn) as access:
+                result = func(conn, *args, **kwargs)
+        except Exception:
+            conn.execute(f"ROLLBACK TO {self.SAVEPOINT}")
+            conn.execute(f"RELEASE {self.SAVEPOINT}")
+            self.failed += 1
+            notify_commit(database_path(conn), access.writes)
+            raise
+        conn.execute(f"RELEASE {self.SAVEPOINT}")
+        self.written |= access.writes
+        self.pending += 1
+        self.calls += 1
+
+        full = self.max_calls is not None and self.pending >= self.max_calls
+        late = self.max_delay is not None and time.monotonic() - self._started >= self.max_delay
+        if full or late:
+            self.commit()
+        return result
+
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.commit()
+            self.commits += 1
+            notify_commit(database_path(self.conn), self.written)
+        self.written = set()
+        self.pending = 0
+
+    def rollback(self):
+        if self.conn.in_transaction:
+            self.conn.rollback()
+            notify_commit(database_path(self.conn), self.written)
+        self.written = set()
+        self.pending = 0
+
+
+@contextmanager
+def group_commit(max_calls=None, max_delay=None, db_path=None):
+    """
+    Run the @with_db_connection @transactional calls made in this block,
+    in this thread, in one transaction with a savepoint per call:
+
+        with group_commit(max_calls=500):
+            for user_id, email in changes:
+                try:
+                    update_user_email(user_id=user_id, new_email=email)
+                except sqlite3.Error as e:
+                    print(f"Skipped {user_id}: {e}")
+
+    Pending calls are committed when the block exits normally and rolled
+    back if an exception escapes it. Nested blocks join the outer batch.
+    """
+    current = getattr(_local, 'group', None)
+    if current is not None:
+        yield current
+        return
+
+    with get_pool(db_path or DB_PATH).connection() as conn:
+        group = _local.group = GroupCommit(conn, max_calls, max_delay)
+        try:
+            yield group
+        except BaseException:
+            group.rollback()
+            raise
+        else:
+            group.commit()
+        finally:
+            _local.group = None
+
 
 def with_db_connection(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            async with get_async_pool(DB_PATH).connection() as conn:
+                return await func(conn, *args, **kwargs)
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect(r'C:\Users\HP\Desktop\decorators\users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-            return result
-        finally:
-            conn.close()
+        group = getattr(_local, 'group', None)
+        if group is not None:
+            return func(group.conn, *args, **kwargs)
+        with get_pool(DB_PATH).connection() as conn:
+            return func(conn, *args, **kwargs)
     return wrapper
 
+async def _anotify_commit(conn, tables):
+    # the hooks may be cache backends that wait on file locks, keep them
+    # off the event loop
+    if tables:
+        await asyncio.to_thread(notify_commit, await adatabase_path(conn), tables)
+
 def transactional(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(conn, *args, **kwargs):
+            try:
+                async with atrack_tables(conn) as access:
+                    result = await func(conn, *args, **kwargs)
+                await conn.commit()
+                await _anotify_commit(conn, access.writes)
+                return result
+            except Exception:
+                await conn.rollback()
+                # drop anything cached from the writes just undone
+                await _anotify_commit(conn, access.writes)
+                raise
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
+        group = getattr(_local, 'group', None)
+        if group is not None and group.conn is conn:
+            return group.run(func, args, kwargs)
         try:
-            result = func(conn, *args, **kwargs)
+            with track_tables(conn) as access:
+                result = func(conn, *args, **kwargs)
             conn.commit()
+            # let caches drop what they hold from the tables just written
+            notify_commit(database_path(conn), access.writes)
             return result
         except Exception as e:
             conn.rollback()
+            # drop anything cached from the writes just undone
+            notify_commit(database_path(conn), access.writes)
             raise e
     return wrapper
 
@@ -31,4 +176,5 @@ def update_user_email(conn, user_id, new_email):
     cursor.execute("UPDATE users SET email = ? WHERE id = ?", (new_email, user_id))
 
 ### Update user's email with automatic transaction handling
-update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
\ No newline at end of file
+if __name__ == "__main__":
+    update_user_email(user_id=1, new_email='Crawford_Cartwright@hotmail.com')
\ No newline at end of file
@@ -1,39 +1,208 @@
+import asyncio
 import time
+import random
 import sqlite3
 import functools
+import inspect
+import threading
+from collections import Counter
+from db_pool import get_pool, get_async_pool, DB_PATH
 
 def with_db_connection(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            async with get_async_pool(DB_PATH).connection() as conn:
+                return await func(conn, *args, **kwargs)
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect(r'C:\Users\HP\Desktop\decorators\users.db')
-        try:
-            result = func(conn, *args, **kwargs)
-            return result
-        finally:
-            conn.close()
+        with get_pool(DB_PATH).connection() as conn:
+            return func(conn, *args, **kwargs)
     return wrapper
 
-def retry_on_failure(retries=3,delay=2):
+# messages SQLite uses when another connection holds the lock we need
+TRANSIENT_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_transient(error):
+    """
+    Default retry classification: only lock contention is worth
+    retrying, other errors would fail the same way again
+    """
+    return isinstance(error, sqlite3.OperationalError) and any(
+        message in str(error).lower() for message in TRANSIENT_MESSAGES)
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every policy using it, so that when the
+    database is in trouble the callers together can't turn each failure
+    into a retry storm. A retry costs one token. Tokens come back at
+    `ratio` per successful call and `refill_rate` per second, up to
+    `capacity`.
+    """
+
+    def __init__(self, capacity=10.0, ratio=0.1, refill_rate=1.0):
+        self.capacity = capacity
+        self.ratio = ratio
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount=0.0):
+        now = time.monotonic()
+        amount += (now - self._updated) * self.refill_rate
+        self._updated = now
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+
+retry_budget = RetryBudget()
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before retrying a failed call.
+
+    Only errors for which retry_on(error) is true are retried, at most
+    `retries` times. Delays grow exponentially from base_delay up to
+    max_delay with full jitter (a random wait between 0 and the
+    exponential delay), so callers that failed together don't retry
+    together. No retry is started that would end after `deadline`
+    seconds from the first attempt, or when the shared budget is empty.
+    `counters` keeps running totals for monitoring.
+    """
+
+    def __init__(self, retries=3, base_delay=0.05, max_delay=2.0, deadline=None,
+                 retry_on=is_transient, budget=retry_budget):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.budget = budget
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, error, attempt, started):
+        """
+        Seconds to wait before retrying after `error` on attempt
+        (counted from 0), or None to give up
+        """
+        if not self.retry_on(error):
+            self._count('not_retryable')
+            return None
+        if attempt >= self.retries:
+            self._count('exhausted')
+            return None
+        delay = self.backoff(attempt)
+        if self.deadline is not None and time.monotonic() - started + delay > self.deadline:
+            self._count('deadline_exceeded')
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            self._count('budget_exhausted')
+            return None
+        self._count('retries')
+        return delay
+
+    def succeeded(self, attempt):
+        self._count('successes')
+        if attempt:
+            self._count('recovered')
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def failed(self):
+        self._count('failures')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        if self.budget is not None:
+            stats['budget_tokens'] = self.budget.tokens
+        return stats
+
+
+def retry_on_failure(retries=3, delay=2, policy=None, **options):
+    """
+    Retry the decorated function according to `policy`, by default a
+    RetryPolicy with `retries` retries and `delay` seconds as base delay.
+    Other keyword arguments (max_delay, deadline, retry_on, budget) are
+    passed to RetryPolicy. The policy is available as wrapper.policy.
+    """
+    policy = policy or RetryPolicy(retries=retries, base_delay=delay, **options)
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.monotonic()
+                attempt = 0
+                while True:
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        wait = policy.next_delay(e, attempt, started)
+                        if wait is None:
+                            policy.failed()
+                            raise
+
+                        print(f"Attempt {attempt + 1} failed: {e}. Retrying in {wait:.2f} seconds...")
+
+                        # wait without blocking the event loop
+                        await asyncio.sleep(wait)
+                        attempt += 1
+                    else:
+                        policy.succeeded(attempt)
+                        return result
+
+            async_wrapper.policy = policy
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = None
-            
-            for attempt in range(retries + 1):
+            started = time.monotonic()
+            attempt = 0
+            while True:
                 try:
                     result = func(*args, **kwargs)
-                    return result
                 except Exception as e:
-                    last_exception = e
-                    
-                    if attempt == retries:
-                        raise last_exception
-                    
-                    print(f"Attempt {attempt + 1} failed: {e}. Retrying in {delay} seconds...")
-                    
+                    wait = policy.next_delay(e, attempt, started)
+                    if wait is None:
+                        policy.failed()
+                        raise
+
+                    print(f"Attempt {attempt + 1} failed: {e}. Retrying in {wait:.2f} seconds...")
+
                     #wait before retrying
-                    time.sleep(delay)
-                    
+                    time.sleep(wait)
+                    attempt += 1
+                else:
+                    policy.succeeded(attempt)
+                    return result
+
+        wrapper.policy = policy
         return wrapper
     return decorator
 
@@ -47,7 +216,9 @@ def fetch_users_with_retry(conn):
     return cursor.fetchall()
 
 #### Attempt to fetch users with automatic retry on failure
-users = fetch_users_with_retry()
-print(users)
+if __name__ == "__main__":
+    users = fetch_users_with_retry()
+    print(users)
+    print(fetch_users_with_retry.policy.stats())
                     
     
\ No newline at end of file
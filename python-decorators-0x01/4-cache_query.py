@@ -1,40 +1,484 @@
+import asyncio
 import time 
-import sqlite3
 import functools
+import inspect
+import sys
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from db_pool import (get_pool, get_async_pool, DB_PATH, track_tables, atrack_tables, database_path,
+                     adatabase_path, register_commit_hook)
 
 def with_db_connection(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            async with get_async_pool(DB_PATH).connection() as conn:
+                return await func(conn, *args, **kwargs)
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect(r'C:\Users\HP\Desktop\decorators\users.db')
+        with get_pool(DB_PATH).connection() as conn:
+            return func(conn, *args, **kwargs)
+    return wrapper
+
+def _sizeof(value):
+    """
+    Approximate memory used by a query result: the list, its row tuples
+    and the values in them
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for row in value:
+            size += sys.getsizeof(row)
+            if isinstance(row, (list, tuple)):
+                size += sum(sys.getsizeof(item) for item in row)
+    return size
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache of query results, bounded by max_entries and
+    max_bytes, with a time to live per entry.
+
+    Each entry remembers the tables its query read, and invalidate(),
+    registered as a db_pool commit hook, drops the entries of tables
+    written by a committed transaction. A result computed while one of
+    its tables was invalidated is not stored, it may already be stale.
+
+    This is the in-process backend of cache_query. cache_backends has
+    SqliteBackend and SharedMemoryBackend with the same methods (version,
+    get, set, invalidate, clear, stats) to share results between
+    processes.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+        # key -> (result, size, expires_at, tables)
+        self._entries = OrderedDict()
+        # (db_path, table) -> keys of the entries that read it
+        self._by_table = defaultdict(set)
+        # (db_path, table) -> self._version when it was last invalidated
+        self._invalidated = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def version(self):
+        """
+        Token to pass to set() for a result computed from now on
+        """
+        return self._version
+
+    def get(self, key, stale_for=0.0):
+        """
+        Return (found, result, stale). An entry that expired less than
+        stale_for seconds ago is still returned, with stale=True.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            stale = False
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                stale = entry[2] + stale_for > time.monotonic()
+                if not stale:
+                    self._remove(key)
+                    self.expirations += 1
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None, False
+            self._entries.move_to_end(key)
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[0], stale
+
+    def set(self, key, result, tables=(), ttl=None, version=None):
+        db_path = key[0]
+        size = _sizeof(result)
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if version is not None and any(
+                    self._invalidated.get((db_path, table), -1) > version for table in tables):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, expires_at, frozenset(tables))
+            self.bytes += size
+            for table in tables:
+                self._by_table[(db_path, table)].add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _, tables = self._entries.pop(key)
+        self.bytes -= size
+        for table in tables:
+            keys = self._by_table.get((key[0], table))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[(key[0], table)]
+
+    def invalidate(self, db_path, tables):
+        """
+        Drop the entries that read any of `tables` in db_path
+        """
+        with self._lock:
+            self._version += 1
+            for table in tables:
+                self._invalidated[(db_path, table)] = self._version
+                for key in list(self._by_table.get((db_path, table), ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+query_cache = QueryCache()
+register_commit_hook(query_cache.invalidate)
+
+# event loop -> {cache key: future of the coroutine currently computing it},
+# a future can only be awaited in the loop it belongs to
+_in_flight = weakref.WeakKeyDictionary()
+# keep background refresh tasks referenced until they finish
+_refresh_tasks = set()
+# result of an in-flight future whose runner was cancelled: its waiters
+# look the key up again and one of them runs the query
+_ABANDONED = object()
+
+
+class _Flight:
+    """
+    One execution of a query, shared by the threads that miss the same
+    key while it runs
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# cache key -> _Flight currently computing it
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _loop_flights():
+    loop = asyncio.get_running_loop()
+    with _flights_lock:
+        flights = _in_flight.get(loop)
+        if flights is None:
+            flights = _in_flight[loop] = {}
+        return flights
+
+
+def _join_flight(key):
+    """
+    Return (flight, leader): the running flight for key, or a new one
+    that the caller (the leader) must complete with _land()
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+
+def _land(key, flight, result=None, error=None):
+    with _flights_lock:
+        _flights.pop(key, None)
+    flight.result = result
+    flight.error = error
+    flight.done.set()
+
+def _find_conn(args, kwargs):
+    if 'conn' in kwargs:
+        return kwargs['conn']
+    return args[0] if args else None
+
+def _find_query(args, kwargs):
+    if 'query' in kwargs:
+        return kwargs['query']
+    if len(args) > 1 and isinstance(args[1], str):
+        return args[1]
+    return None
+
+def _key_value(value):
+    if isinstance(value, dict):
+        return tuple(sorted((name, _key_value(item)) for name, item in value.items()))
+    if isinstance(value, (tuple, list)):
+        return tuple(_key_value(item) for item in value)
+    return value
+
+def _cache_key(args, kwargs, query, db_path):
+    """
+    Key of one call: the database, the query and every other argument
+    besides the connection, keyword arguments sorted by name. None when
+    the database file is unknown (or in memory) or an argument can't be
+    part of a key, the call then bypasses the cache.
+    """
+    if not db_path or db_path == ':memory:':
+        return None
+    rest = args if 'conn' in kwargs else args[1:]
+    if 'query' not in kwargs:
+        rest = rest[1:]
+    others = {name: value for name, value in kwargs.items() if name not in ('conn', 'query')}
+    try:
+        params = _key_value(rest) + _key_value(others)
+        key = db_path, query, params
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def _on_connection(conn, args, kwargs):
+    """
+    The arguments of a call with conn in place of the caller's connection
+    """
+    if 'conn' in kwargs:
+        return args, dict(kwargs, conn=conn)
+    return (conn,) + args[1:], kwargs
+
+def _execute(func, conn, args, kwargs, cache, key, ttl):
+    """
+    Run the query and store its result along with the tables it read.
+    A result read inside an open transaction may see writes that are
+    rolled back later, so it is returned without being stored.
+    """
+    version = cache.version()
+    with track_tables(conn) as access:
+        result = func(*args, **kwargs)
+    if not conn.in_transaction:
+        cache.set(key, result, access.reads, ttl, version)
+    return result
+
+async def _cache_call(cache, name, *args):
+    """
+    Call a cache method from a coroutine. Backends that wait on files or
+    locks (blocking = True) are called in a worker thread so the event
+    loop keeps running meanwhile.
+    """
+    method = getattr(cache, name)
+    if getattr(cache, 'blocking', False):
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def _aexecute(func, conn, args, kwargs, cache, key, ttl):
+    version = await _cache_call(cache, 'version')
+    async with atrack_tables(conn) as access:
+        result = await func(*args, **kwargs)
+    if not conn.in_transaction:
+        await _cache_call(cache, 'set', key, result, access.reads, ttl, version)
+    return result
+
+def _settings(conn):
+    return conn.row_factory, conn.text_factory
+
+def _apply_settings(conn, settings):
+    conn.row_factory, conn.text_factory = settings
+
+def _refresh(func, args, kwargs, cache, key, ttl, flight, settings):
+    """
+    Recompute a stale entry in the background on a connection of its
+    own, the caller's one goes back to the pool as soon as it returns.
+    Keys always hold the caller's database path (_cache_key skips the
+    cache otherwise) and the caller's row_factory and text_factory are
+    copied over, so the new result has the same shape as the stale one.
+    """
+    try:
+        with get_pool(key[0]).connection() as conn:
+            _apply_settings(conn, settings)
+            result = _execute(func, conn, *_on_connection(conn, args, kwargs), cache, key, ttl)
+    except Exception as e:
+        print(f"Background refresh failed for query: {key[1]}: {e}")
+        _land(key, flight, error=e)
+    else:
+        _land(key, flight, result)
+
+async def _arefresh(func, args, kwargs, cache, key, ttl, pending, settings):
+    try:
+        async with get_async_pool(key[0]).connection() as conn:
+            _apply_settings(conn, settings)
+            result = await _aexecute(func, conn, *_on_connection(conn, args, kwargs), cache, key, ttl)
+    except asyncio.CancelledError:
+        pending.set_result(_ABANDONED)
+        raise
+    except Exception as e:
+        print(f"Background refresh failed for query: {key[1]}: {e}")
+        pending.set_exception(e)
+        pending.exception()
+    else:
+        pending.set_result(result)
+    finally:
+        _loop_flights().pop(key, None)
+
+def _cache_query_async(func, cache, ttl, stale_for):
+    """
+    Coroutine version of cache_query. Concurrent misses for the same
+    query share one execution: the first caller runs it and the others
+    await its result.
+    """
+    @functools.wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        query = _find_query(args, kwargs)
+        conn = _find_conn(args, kwargs)
+        if not query or conn is None:
+            return await func(*args, **kwargs)
+
+        key = _cache_key(args, kwargs, query, await adatabase_path(conn))
+        if key is None:
+            print(f"Can't cache query, running it: {query}")
+            return await func(*args, **kwargs)
+
+        in_flight = _loop_flights()
+        while True:
+            found, result, stale = await _cache_call(cache, 'get', key, stale_for)
+            if found and not stale:
+                print(f"Cache hit for query: {query}")
+                return result
+
+            pending = in_flight.get(key)
+            if found:
+                if pending is None:
+                    pending = in_flight[key] = asyncio.get_running_loop().create_future()
+                    task = asyncio.ensure_future(_arefresh(func, args, kwargs, cache, key, ttl, pending,
+                                                           _settings(conn)))
+                    _refresh_tasks.add(task)
+                    task.add_done_callback(_refresh_tasks.discard)
+                print(f"Serving stale result for query: {query}")
+                return result
+
+            if pending is None:
+                break
+            print(f"Waiting for in-flight query: {query}")
+            # shield so one cancelled waiter does not cancel the shared execution
+            result = await asyncio.shield(pending)
+            if result is not _ABANDONED:
+                return result
+
+        pending = in_flight[key] = asyncio.get_running_loop().create_future()
         try:
-            result = func(conn, *args, **kwargs)
-            return result
+            result = await _aexecute(func, conn, args, kwargs, cache, key, ttl)
+        except asyncio.CancelledError:
+            # only this caller was cancelled, let a waiter take the query over
+            pending.set_result(_ABANDONED)
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # mark it retrieved, nobody may be waiting
+            pending.exception()
+            raise
         finally:
-            conn.close()
-    return wrapper
+            in_flight.pop(key, None)
+
+        pending.set_result(result)
+        print(f"Cache miss. Cache result for query: {query}.")
+        return result
+    return async_wrapper
 
-query_cache = {}
+def cache_query(func=None, *, ttl=None, cache=None, stale_while_revalidate=None):
+    """
+    Cache the result of the decorated function, keyed by database path,
+    query and every other argument, in `cache` (query_cache by default).
+    Results expire after ttl seconds (the cache's ttl by default) and
+    are invalidated by commits through transactional to the tables the
+    query read. Concurrent misses for the same key run the query once
+    and share its result. With stale_while_revalidate=N an entry that
+    expired less than N seconds ago is returned as is while one
+    background refresh replaces it. The refresh runs on a pooled
+    connection to the same database with the caller's row_factory and
+    text_factory; other state set on the caller's connection (attached
+    databases, temp tables, user functions) is not there. Works bare
+    (@cache_query) or with options (@cache_query(ttl=60, stale_while_revalidate=30)).
+
+    To share results between worker processes pass a backend from
+    cache_backends, e.g. @cache_query(cache=SqliteBackend('/tmp/query_cache.db')).
+    Every process that writes through transactional must create the same
+    backend, its commit hook is what invalidates the shared entries.
+    """
+    if func is None:
+        return functools.partial(cache_query, ttl=ttl, cache=cache,
+                                 stale_while_revalidate=stale_while_revalidate)
+
+    cache = cache or query_cache
+    stale_for = stale_while_revalidate or 0.0
+    if inspect.iscoroutinefunction(func):
+        return _cache_query_async(func, cache, ttl, stale_for)
 
-def cache_query(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        query = None
-        
-        if 'query' in kwargs:
-            query = kwargs['query']
-        elif len(args) > 1 and isinstance(args[1], str):
-            query = args[1]
-            
-        if query and query in query_cache:
+        query = _find_query(args, kwargs)
+        conn = _find_conn(args, kwargs)
+        if not query or conn is None:
+            return func(*args, **kwargs)
+
+        key = _cache_key(args, kwargs, query, database_path(conn))
+        if key is None:
+            print(f"Can't cache query, running it: {query}")
+            return func(*args, **kwargs)
+
+        found, result, stale = cache.get(key, stale_for)
+        if found and not stale:
             print(f"Cache hit for query: {query}")
-            return query_cache[query]
-        
-        result = func(*args, **kwargs)
-        
-        if query:
-            query_cache[query] = result
-            print(f"Cache miss. Cache result for query: {query}.")
-            
+            return result
+
+        flight, leader = _join_flight(key)
+        if found:
+            if leader:
+                threading.Thread(target=_refresh,
+                                 args=(func, args, kwargs, cache, key, ttl, flight, _settings(conn)),
+                                 name="cache-refresh", daemon=True).start()
+            print(f"Serving stale result for query: {query}")
+            return result
+
+        if not leader:
+            print(f"Waiting for in-flight query: {query}")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            result = _execute(func, conn, args, kwargs, cache, key, ttl)
+        except BaseException as e:
+            _land(key, flight, error=e)
+            raise
+        _land(key, flight, result)
+        print(f"Cache miss. Cache result for query: {query}.")
         return result
     return wrapper
 
@@ -45,8 +489,11 @@ def fetch_users_with_cache(conn, query):
     cursor.execute(query)
     return cursor.fetchall()
 
-#### First call with cache cache the result
-users = fetch_users_with_cache(query="SELECT * FROM users")
+if __name__ == "__main__":
+    #### First call with cache cache the result
+    users = fetch_users_with_cache(query="SELECT * FROM users")
+
+    #### Second call will use cached result
+    users_again = fetch_users_with_cache(query="SELECT * FROM users")
 
-#### Second call will use cached result
-users_again = fetch_users_with_cache(query="SELECT * FROM users")
+    print(query_cache.stats())
@@ -0,0 +1,240 @@
+import time
+import sqlite3
+import functools
+import importlib
+import inspect
+import threading
+from collections import deque
+from db_pool import get_pool, get_async_pool, DB_PATH
+
+retry_on_failure = importlib.import_module('3-retry_on_failure').retry_on_failure
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def with_db_connection(func):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            async with get_async_pool(DB_PATH).connection() as conn:
+                return await func(conn, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with get_pool(DB_PATH).connection() as conn:
+            return func(conn, *args, **kwargs)
+    return wrapper
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the function while its circuit is open
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.1f} seconds")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_failure(error):
+    """
+    Default classification: only database errors count against the
+    circuit, a bug in the calling code says nothing about the database
+    """
+    return isinstance(error, sqlite3.Error)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for one target.
+
+    closed: calls go through and their outcome is recorded in a sliding
+    window of the last window_size calls. Once at least min_calls are
+    recorded and the share of failures reaches failure_rate, the circuit
+    opens.
+    open: calls fail at once with CircuitOpenError for reset_timeout
+    seconds, then the circuit becomes half-open.
+    half-open: up to half_open_calls trial calls go through. If they all
+    succeed the circuit closes again, the first failure opens it.
+    """
+
+    def __init__(self, name, failure_rate=0.5, window_size=20, min_calls=5, reset_timeout=30.0,
+                 half_open_calls=1, is_failure=is_failure):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._window = deque(maxlen=window_size)
+        self._failures = 0
+        self._opened_at = None
+        self._trials = 0
+        self._trial_successes = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        self.state = CLOSED
+        self._window.clear()
+        self._failures = 0
+
+    def allow(self):
+        """
+        Raise CircuitOpenError unless a call may go through now
+        """
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = HALF_OPEN
+                self._trials = 0
+                self._trial_successes = 0
+
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._trials += 1
+
+    def record(self, failed):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_calls:
+                    self._close()
+                return
+
+            if self.state == OPEN:
+                # a call let through before the circuit opened
+                return
+
+            if len(self._window) == self._window.maxlen:
+                self._failures -= self._window[0]
+            self._window.append(failed)
+            self._failures += failed
+            if len(self._window) >= self.min_calls and self._failures >= self.failure_rate * len(self._window):
+                self._open()
+
+    def record_error(self, error):
+        self.record(self.is_failure(error))
+
+    def release(self):
+        """
+        Give back the trial slot of a call that ended without an outcome
+        (cancelled or interrupted), so the next call can be the trial
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls_in_window': len(self._window),
+                'failures_in_window': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name=None, **options):
+    """
+    Return the shared CircuitBreaker for `name` (the database path by
+    default), creating it with `options` the first time
+    """
+    name = name or DB_PATH
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+
+def circuit_breaker(func=None, *, name=None, **options):
+    """
+    Fail fast with CircuitOpenError while the circuit of `name` is open.
+    All functions decorated with the same name share one breaker, by
+    default the one of the database. Works bare (@circuit_breaker) or
+    with CircuitBreaker options (@circuit_breaker(failure_rate=0.3)).
+    Put it outside @retry_on_failure so that an open circuit skips the
+    retries and a whole retried call counts as one outcome.
+    """
+    if func is None:
+        return functools.partial(circuit_breaker, name=name, **options)
+
+    breaker = get_breaker(name, **options)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            breaker.allow()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                breaker.record_error(e)
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record(False)
+            return result
+
+        async_wrapper.breaker = breaker
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        breaker.allow()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            breaker.record_error(e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(False)
+        return result
+
+    wrapper.breaker = breaker
+    return wrapper
+
+
+@with_db_connection
+@circuit_breaker
+@retry_on_failure(retries=3, delay=1)
+def fetch_users_guarded(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users")
+    return cursor.fetchall()
+
+#### Fetch users, failing fast while the database keeps failing
+if __name__ == "__main__":
+    try:
+        users = fetch_users_guarded()
+        print(users)
+    except CircuitOpenError as e:
+        print(e)
+    print(fetch_users_guarded.breaker.stats())
@@ -0,0 +1,606 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from itertools import accumulate
+from db_pool import register_commit_hook, unregister_commit_hook
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Results are encoded column by column. Header: kind of result, row
+# count, column count. Each column starts with a tag, ORed with HAS_NULLS
+# when a one byte per row null mask follows, then holds its non-null
+# values: ints as an array of the narrowest item size that fits, floats
+# as an array of doubles, text and blobs as an array of lengths plus the
+# values joined together, and anything else one tagged value at a time.
+# Arrays use the native byte order, the cache never leaves the host.
+RESULT_ROWS, RESULT_ROW, RESULT_NONE = 0, 1, 2
+COL_NULL, COL_INT, COL_FLOAT, COL_TEXT, COL_BLOB, COL_MIXED = 0, 1, 2, 3, 4, 5
+HAS_NULLS = 0x80
+
+_HEADER = struct.Struct('<BII')
+_BYTE = struct.Struct('<B')
+_LENGTH = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_INT_RANGES = (('b', -2 ** 7, 2 ** 7), ('h', -2 ** 15, 2 ** 15), ('i', -2 ** 31, 2 ** 31),
+               ('q', -2 ** 63, 2 ** 63))
+_LENGTH_RANGES = (('B', 0, 2 ** 8), ('H', 0, 2 ** 16), ('I', 0, 2 ** 32))
+
+
+def _pack_array(ranges, values, parts):
+    low, high = (min(values), max(values)) if values else (0, 0)
+    for typecode, smallest, limit in ranges:
+        if smallest <= low and high < limit:
+            parts.append(typecode.encode('ascii'))
+            parts.append(array(typecode, values).tobytes())
+            return
+    raise TypeError("Integer out of range")
+
+
+def _unpack_array(view, offset, count):
+    typecode = chr(view[offset])
+    values = array(typecode)
+    end = offset + 1 + count * values.itemsize
+    values.frombytes(view[offset + 1:end])
+    return values.tolist(), end
+
+
+def _encode_value(value, parts):
+    if isinstance(value, float):
+        parts.append(_BYTE.pack(COL_FLOAT) + _FLOAT.pack(value))
+    elif isinstance(value, int):
+        parts.append(_BYTE.pack(COL_INT) + _INT.pack(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        parts.append(_BYTE.pack(COL_TEXT) + _LENGTH.pack(len(data)) + data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        parts.append(_BYTE.pack(COL_BLOB) + _LENGTH.pack(len(data)) + data)
+    else:
+        raise TypeError(f"Can't encode {type(value).__name__} values")
+
+
+def _decode_value(view, offset):
+    tag = view[offset]
+    offset += 1
+    if tag == COL_FLOAT:
+        return _FLOAT.unpack_from(view, offset)[0], offset + _FLOAT.size
+    if tag == COL_INT:
+        return _INT.unpack_from(view, offset)[0], offset + _INT.size
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    data = view[offset:offset + length]
+    return (str(data, 'utf-8') if tag == COL_TEXT else data.tobytes()), offset + length
+
+
+def _encode_column(column, parts):
+    values = [value for value in column if value is not None]
+    tag = HAS_NULLS if len(values) < len(column) else 0
+    kinds = set(map(type, values))
+
+    if not values:
+        parts.append(_BYTE.pack(COL_NULL))
+        return
+    if kinds == {int}:
+        tag |= COL_INT
+    elif kinds == {float}:
+        tag |= COL_FLOAT
+    elif kinds == {str}:
+        tag |= COL_TEXT
+    elif kinds == {bytes}:
+        tag |= COL_BLOB
+    else:
+        tag |= COL_MIXED
+
+    parts.append(_BYTE.pack(tag))
+    if tag & HAS_NULLS:
+        parts.append(bytes(value is None for value in column))
+    kind = tag & ~HAS_NULLS
+    if kind == COL_INT:
+        _pack_array(_INT_RANGES, values, parts)
+    elif kind == COL_FLOAT:
+        parts.append(array('d', values).tobytes())
+    elif kind == COL_TEXT:
+        # lengths in characters, the joined text is decoded in one go
+        _pack_array(_LENGTH_RANGES, list(map(len, values)), parts)
+        data = ''.join(values).encode('utf-8')
+        parts.append(_LENGTH.pack(len(data)))
+        parts.append(data)
+    elif kind == COL_BLOB:
+        _pack_array(_LENGTH_RANGES, list(map(len, values)), parts)
+        parts.extend(values)
+    else:
+        for value in values:
+            _encode_value(value, parts)
+
+
+def _decode_column(view, offset, count):
+    tag = view[offset]
+    offset += 1
+    if tag == COL_NULL:
+        return [None] * count, offset
+
+    nulls = None
+    if tag & HAS_NULLS:
+        nulls = view[offset:offset + count]
+        offset += count
+        count -= sum(nulls)
+    kind = tag & ~HAS_NULLS
+
+    if kind == COL_INT:
+        values, offset = _unpack_array(view, offset, count)
+    elif kind == COL_FLOAT:
+        values = array('d')
+        values.frombytes(view[offset:offset + count * values.itemsize])
+        offset += count * values.itemsize
+        values = values.tolist()
+    elif kind in (COL_TEXT, COL_BLOB):
+        lengths, offset = _unpack_array(view, offset, count)
+        if kind == COL_TEXT:
+            (size,) = _LENGTH.unpack_from(view, offset)
+            offset += _LENGTH.size
+            data = str(view[offset:offset + size], 'utf-8')
+            offset += size
+        else:
+            data = view[offset:offset + sum(lengths)].tobytes()
+            offset += len(data)
+        values = []
+        start = 0
+        for end in accumulate(lengths):
+            values.append(data[start:end])
+            start = end
+    else:
+        values = []
+        for _ in range(count):
+            value, offset = _decode_value(view, offset)
+            values.append(value)
+
+    if nulls is not None:
+        present = iter(values)
+        values = [None if null else next(present) for null in nulls]
+    return values, offset
+
+
+def encode_result(result):
+    """
+    Encode a fetchall() list of row tuples, a fetchone() tuple or None
+    into bytes holding only the SQLite storage classes, smaller and
+    faster to load than a pickle. Raises TypeError for anything else.
+    """
+    if result is None:
+        return _HEADER.pack(RESULT_NONE, 0, 0)
+    if isinstance(result, tuple):
+        kind, rows = RESULT_ROW, [result]
+    elif isinstance(result, list) and all(type(row) is tuple for row in result):
+        kind, rows = RESULT_ROWS, result
+    else:
+        raise TypeError(f"Can't encode {type(result).__name__} results")
+
+    width = len(rows[0]) if rows else 0
+    if any(len(row) != width for row in rows):
+        raise TypeError("Can't encode rows of different lengths")
+
+    parts = [_HEADER.pack(kind, len(rows), width)]
+    try:
+        for column in zip(*rows):
+            _encode_column(column, parts)
+    except (OverflowError, struct.error) as e:
+        raise TypeError(f"Can't encode result: {e}")
+    return b''.join(parts)
+
+
+def decode_result(data):
+    """
+    Inverse of encode_result
+    """
+    view = memoryview(data)
+    kind, count, width = _HEADER.unpack_from(view, 0)
+    if kind == RESULT_NONE:
+        return None
+
+    offset = _HEADER.size
+    columns = []
+    for _ in range(width):
+        values, offset = _decode_column(view, offset, count)
+        columns.append(values)
+    rows = list(zip(*columns)) if columns else [()] * count
+    return rows[0] if kind == RESULT_ROW else rows
+
+
+def key_digest(key):
+    """
+    Fixed 16 byte digest of a cache_query key (db_path, query, params),
+    the same in every process
+    """
+    db_path, query, params = key
+    try:
+        encoded = encode_result((db_path, query) + params)
+    except TypeError:
+        encoded = repr(key).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+
+class SqliteBackend:
+    """
+    cache_query backend stored in a SQLite file, shared by every process
+    on the host that opens the same path. Same interface and settings as
+    QueryCache: LRU eviction by entry count and encoded size, a TTL per
+    entry and invalidation of the entries that read a written table.
+    Results are stored with encode_result(); results it can't encode
+    are simply not cached. Hit and miss counters are per process, the
+    entry and byte counts are shared.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key BLOB PRIMARY KEY,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL,
+        last_used REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_cache_entries_last_used ON cache_entries(last_used);
+    CREATE TABLE IF NOT EXISTS cache_tables (
+        db_path TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        key BLOB NOT NULL,
+        PRIMARY KEY (db_path, table_name, key)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_cache_tables_key ON cache_tables(key);
+    CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR IGNORE INTO cache_meta VALUES ('version', 0), ('entries', 0), ('bytes', 0);
+    CREATE TRIGGER IF NOT EXISTS cache_entries_insert AFTER INSERT ON cache_entries BEGIN
+        UPDATE cache_meta SET value = value + 1 WHERE name = 'entries';
+        UPDATE cache_meta SET value = value + new.size WHERE name = 'bytes';
+    END;
+    CREATE TRIGGER IF NOT EXISTS cache_entries_delete AFTER DELETE ON cache_entries BEGIN
+        UPDATE cache_meta SET value = value - 1 WHERE name = 'entries';
+        UPDATE cache_meta SET value = value - old.size WHERE name = 'bytes';
+        DELETE FROM cache_tables WHERE key = old.key;
+    END;
+    """
+
+    # calls may wait on the file lock, coroutines run them in a thread
+    blocking = True
+
+    # a hit only refreshes last_used when it is older than this, so
+    # reading a hot entry doesn't mean writing the file every time
+    TOUCH_INTERVAL = 1.0
+
+    def __init__(self, path=None, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=300.0):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'query_cache.db')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+        register_commit_hook(self.invalidate)
+
+    def _conn(self):
+        # one connection per thread, and new ones after a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _meta(self, conn, name):
+        return conn.execute("SELECT value FROM cache_meta WHERE name = ?", (name,)).fetchone()[0]
+
+    def version(self):
+        return self._meta(self._conn(), 'version')
+
+    def get(self, key, stale_for=0.0):
+        digest = key_digest(key)
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at, last_used FROM cache_entries WHERE key = ?",
+                           (digest,)).fetchone()
+        now = time.time()
+        stale = False
+        if row is not None and row[1] is not None and row[1] <= now:
+            stale = row[1] + stale_for > now
+            if not stale:
+                with self._write() as conn:
+                    conn.execute("DELETE FROM cache_entries WHERE key = ? AND expires_at <= ?", (digest, now))
+                self.expirations += 1
+                row = None
+        if row is None:
+            self.misses += 1
+            return False, None, False
+
+        if now - row[2] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, digest))
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return True, decode_result(row[0]), stale
+
+    def set(self, key, result, tables=(), ttl=None, version=None):
+        try:
+            data = encode_result(result)
+        except TypeError:
+            return
+        if len(data) > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        digest = key_digest(key)
+
+        with self._write() as conn:
+            # another process may have invalidated since the query started
+            if version is not None and self._meta(conn, 'version') > version:
+                return
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (digest,))
+            conn.execute("INSERT INTO cache_entries VALUES (?, ?, ?, ?, ?)",
+                         (digest, data, len(data), expires_at, now))
+            conn.executemany("INSERT OR IGNORE INTO cache_tables VALUES (?, ?, ?)",
+                             [(key[0], table, digest) for table in tables])
+            while self._meta(conn, 'entries') > self.max_entries or self._meta(conn, 'bytes') > self.max_bytes:
+                conn.execute("DELETE FROM cache_entries WHERE key = "
+                             "(SELECT key FROM cache_entries ORDER BY last_used LIMIT 1)")
+                self.evictions += 1
+
+    def invalidate(self, db_path, tables):
+        tables = list(tables)
+        placeholders = ', '.join('?' * len(tables))
+        with self._write() as conn:
+            conn.execute("UPDATE cache_meta SET value = value + 1 WHERE name = 'version'")
+            cursor = conn.execute(
+                f"DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_tables "
+                f"WHERE db_path = ? AND table_name IN ({placeholders}))", [db_path] + tables)
+            self.invalidations += cursor.rowcount
+
+    def clear(self):
+        with self._write() as conn:
+            conn.execute("DELETE FROM cache_entries")
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            'entries': self._meta(conn, 'entries'),
+            'bytes': self._meta(conn, 'bytes'),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+class SharedMemoryBackend:
+    """
+    cache_query backend in a memory-mapped file (under /dev/shm when
+    available) shared by every process on the host that maps the same
+    path. The file is a fixed table of `slots` slots of slot_size bytes
+    grouped into sets of WAYS: a key can only live in its set, and
+    storing into a full set evicts its least recently used entry.
+    Results whose encoding doesn't fit a slot, or that read more than
+    MAX_TABLES tables, are not cached. Access is serialized with a flock()
+    lock on the file plus a thread lock, so it needs fcntl.
+    Hit and miss counters are per process.
+    """
+
+    # calls may wait on the file lock, coroutines run them in a thread
+    blocking = True
+
+    MAGIC = b'QCACHE01'
+    WAYS = 4
+    MAX_TABLES = 8
+    # magic, version, slots, slot_size
+    _FILE_HEADER = struct.Struct('<8sQII')
+    _DATA_START = 64
+    # key digest, expires_at (0 = never), last_used, data length, table tags
+    _SLOT = struct.Struct(f'<16sddI{MAX_TABLES}I')
+    _EMPTY = bytes(16)
+
+    def __init__(self, path=None, slots=1024, slot_size=64 * 1024, ttl=300.0):
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryBackend needs fcntl, which is only available on POSIX systems")
+        if slots % self.WAYS:
+            raise ValueError(f"slots must be a multiple of {self.WAYS}")
+        shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.path = path or os.path.join(shm, 'query_cache.shm')
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        size = self._DATA_START + slots * slot_size
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, self._FILE_HEADER.pack(self.MAGIC, 0, slots, slot_size), 0)
+            magic, _, file_slots, file_slot_size = self._FILE_HEADER.unpack(
+                os.pread(self._fd, self._FILE_HEADER.size, 0))
+            if (magic, file_slots, file_slot_size) != (self.MAGIC, slots, slot_size):
+                raise ValueError(f"{self.path} holds a different cache layout")
+            self._map = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        register_commit_hook(self.invalidate)
+
+    @contextmanager
+    def _locked(self):
+        # flock() locks belong to this instance's open file, so they also keep
+        # out other instances in this process; the thread lock covers threads
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, index):
+        return self._DATA_START + index * self.slot_size
+
+    def _read_slot(self, index):
+        return self._SLOT.unpack_from(self._map, self._offset(index))
+
+    def _clear_slot(self, index):
+        self._SLOT.pack_into(self._map, self._offset(index), self._EMPTY, 0.0, 0.0, 0, *[0] * self.MAX_TABLES)
+
+    def _set_indexes(self, digest):
+        first = int.from_bytes(digest[:8], 'little') % (self.slots // self.WAYS) * self.WAYS
+        return range(first, first + self.WAYS)
+
+    def _tag(self, db_path, table):
+        # 0 marks an unused tag
+        return int.from_bytes(hashlib.blake2b(f"{db_path}\0{table}".encode('utf-8'), digest_size=4).digest(),
+                              'little') or 1
+
+    def _version(self):
+        return self._FILE_HEADER.unpack_from(self._map, 0)[1]
+
+    def version(self):
+        with self._locked():
+            return self._version()
+
+    def get(self, key, stale_for=0.0):
+        digest = key_digest(key)
+        with self._locked():
+            for index in self._set_indexes(digest):
+                slot = self._read_slot(index)
+                if slot[0] == digest:
+                    break
+            else:
+                self.misses += 1
+                return False, None, False
+
+            now = time.time()
+            expires_at, length = slot[1], slot[3]
+            stale = False
+            if expires_at and expires_at <= now:
+                stale = expires_at + stale_for > now
+                if not stale:
+                    self._clear_slot(index)
+                    self.expirations += 1
+                    self.misses += 1
+                    return False, None, False
+
+            struct.pack_into('<d', self._map, self._offset(index) + 24, now)
+            start = self._offset(index) + self._SLOT.size
+            data = self._map[start:start + length]
+
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return True, decode_result(data), stale
+
+    def set(self, key, result, tables=(), ttl=None, version=None):
+        if len(tables) > self.MAX_TABLES:
+            return
+        try:
+            data = encode_result(result)
+        except TypeError:
+            return
+        if self._SLOT.size + len(data) > self.slot_size:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else 0.0
+        tags = [self._tag(key[0], table) for table in tables]
+        tags += [0] * (self.MAX_TABLES - len(tags))
+        digest = key_digest(key)
+
+        with self._locked():
+            # another process may have invalidated since the query started
+            if version is not None and self._version() > version:
+                return
+            victim = None
+            for index in self._set_indexes(digest):
+                slot = self._read_slot(index)
+                expired = slot[1] and slot[1] <= now
+                if slot[0] == digest or slot[0] == self._EMPTY or expired:
+                    victim = index
+                    break
+                if victim is None or slot[2] < self._read_slot(victim)[2]:
+                    victim = index
+            else:
+                self.evictions += 1
+
+            offset = self._offset(victim)
+            self._SLOT.pack_into(self._map, offset, digest, expires_at, now, len(data), *tags)
+            self._map[offset + self._SLOT.size:offset + self._SLOT.size + len(data)] = data
+
+    def invalidate(self, db_path, tables):
+        tags = {self._tag(db_path, table) for table in tables}
+        with self._locked():
+            magic, version, slots, slot_size = self._FILE_HEADER.unpack_from(self._map, 0)
+            self._FILE_HEADER.pack_into(self._map, 0, magic, version + 1, slots, slot_size)
+            for index in range(self.slots):
+                slot = self._read_slot(index)
+                if slot[0] != self._EMPTY and tags.intersection(slot[4:]):
+                    self._clear_slot(index)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._locked():
+            for index in range(self.slots):
+                self._clear_slot(index)
+
+    def stats(self):
+        entries = 0
+        size = 0
+        with self._locked():
+            for index in range(self.slots):
+                slot = self._read_slot(index)
+                if slot[0] != self._EMPTY:
+                    entries += 1
+                    size += slot[3]
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def close(self):
+        unregister_commit_hook(self.invalidate)
+        self._map.close()
+        os.close(self._fd)
@@ -0,0 +1,547 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+# override with the USERS_DB environment variable or the db_path arguments
+DB_PATH = os.environ.get('USERS_DB', r'C:\Users\HP\Desktop\decorators\users.db')
+
+WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+
+
+class TableAccess:
+    """
+    Names of the tables read and written by the statements run on a
+    connection while track_tables() is active
+    """
+
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+
+    def update(self, other):
+        self.reads |= other.reads
+        self.writes |= other.writes
+
+
+def _authorizer(trackers):
+    def authorize(action, table, column, db_name, trigger):
+        if table and not table.startswith('sqlite_'):
+            for access in trackers:
+                if action == sqlite3.SQLITE_READ:
+                    access.reads.add(table)
+                elif action in WRITE_ACTIONS:
+                    access.writes.add(table)
+        return sqlite3.SQLITE_OK
+    return authorize
+
+
+class TrackedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return self.connection.run_statement(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.connection.run_statement(super().executemany, sql, *args)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that remembers the database it was opened on and
+    the tables its statements touch, for track_tables().
+
+    The authorizer reporting the tables is installed once, since
+    installing one expires every prepared statement. It only runs when
+    a statement is prepared, so the tables are remembered by SQL for
+    the runs served from the statement cache.
+    """
+    db_path = None
+    authorizer_changed = False
+    # remembered statements before they are all forgotten and prepared again
+    max_statements = 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # TableAccess objects of the active track_tables() blocks
+        self.trackers = []
+        self._statements = {}
+        self._preparing = []
+        self.authorizer = _authorizer(self._preparing)
+        super().set_authorizer(self.authorizer)
+
+    def set_authorizer(self, authorizer_callback):
+        self.authorizer_changed = authorizer_callback is not self.authorizer
+        return super().set_authorizer(authorizer_callback)
+
+    def run_statement(self, execute, sql, *args):
+        access = TableAccess()
+        self._preparing.append(access)
+        try:
+            return execute(sql, *args)
+        finally:
+            self._preparing.clear()
+            if access.reads or access.writes:
+                if sql not in self._statements and len(self._statements) >= self.max_statements:
+                    self._statements.clear()
+                    if not self.authorizer_changed:
+                        # expire the prepared statements so they report again
+                        super().set_authorizer(self.authorizer)
+                self._statements[sql] = access
+            if self.trackers:
+                access = self._statements.get(sql, access)
+                for tracker in self.trackers:
+                    tracker.update(access)
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TrackedCursor)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql_script):
+        # scripts bypass the statement cache, every statement is prepared
+        self._preparing.extend(self.trackers)
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._preparing.clear()
+
+
+def database_path(conn):
+    """
+    Path of the database conn is connected to, '' if unknown
+    """
+    path = getattr(conn, 'db_path', None)
+    if path is None and isinstance(conn, sqlite3.Connection):
+        path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return path or ''
+
+
+async def adatabase_path(conn):
+    """
+    database_path() for aiosqlite connections. The sqlite3 connection
+    inside belongs to aiosqlite's thread, so the path is asked for
+    through the connection and remembered on it.
+    """
+    path = getattr(conn, 'db_path', None)
+    if path is None:
+        async with conn.execute("PRAGMA database_list") as cursor:
+            path = (await cursor.fetchone())[2]
+        conn.db_path = path
+    return path or ''
+
+
+# id(conn) -> TableAccess objects collecting for a connection not opened by a pool
+_trackers = {}
+
+
+def _push_tracker(conn):
+    access = TableAccess()
+    trackers = _trackers.setdefault(id(conn), [])
+    trackers.append(access)
+    # installing an authorizer expires the prepared statements, so cached
+    # statements are prepared again and reported too
+    return access, (_authorizer(trackers) if len(trackers) == 1 else None)
+
+
+def _pop_tracker(conn, access):
+    trackers = _trackers[id(conn)]
+    trackers.remove(access)
+    if trackers:
+        return False
+    del _trackers[id(conn)]
+    return True
+
+
+@contextmanager
+def track_tables(conn):
+    """
+    Collect the tables the statements run on conn inside the block touch
+    """
+    if isinstance(conn, PooledConnection):
+        access = TableAccess()
+        conn.trackers.append(access)
+        try:
+            yield access
+        finally:
+            conn.trackers.remove(access)
+        return
+
+    access, authorizer = _push_tracker(conn)
+    if authorizer:
+        conn.set_authorizer(authorizer)
+    try:
+        yield access
+    finally:
+        if _pop_tracker(conn, access):
+            conn.set_authorizer(None)
+
+
+@asynccontextmanager
+async def atrack_tables(conn):
+    """
+    track_tables() for aiosqlite connections
+    """
+    # the sqlite3 connection aiosqlite runs the statements on
+    pooled = getattr(conn, '_connection', None)
+    if isinstance(pooled, PooledConnection):
+        access = TableAccess()
+        pooled.trackers.append(access)
+        try:
+            yield access
+        finally:
+            pooled.trackers.remove(access)
+        return
+
+    access, authorizer = _push_tracker(conn)
+    if authorizer:
+        await conn.set_authorizer(authorizer)
+    try:
+        yield access
+    finally:
+        if _pop_tracker(conn, access):
+            await conn.set_authorizer(None)
+
+
+_commit_hooks = []
+
+
+def register_commit_hook(hook):
+    """
+    Call hook(db_path, tables) whenever a transaction that wrote to
+    `tables` is committed or rolled back through transactional
+    """
+    _commit_hooks.append(hook)
+    return hook
+
+
+def unregister_commit_hook(hook):
+    if hook in _commit_hooks:
+        _commit_hooks.remove(hook)
+
+
+def notify_commit(db_path, tables):
+    if not tables:
+        return
+    for hook in list(_commit_hooks):
+        hook(db_path, frozenset(tables))
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections to one database file.
+
+    At most `size` connections exist at once; callers wait up to
+    `timeout` seconds for one to be returned. Connections idle for more
+    than idle_timeout seconds are closed instead of reused, and with
+    pre_ping=True a connection is checked with SELECT 1 before it is
+    handed out. Each connection keeps its own cache of up to
+    statement_cache_size prepared statements, which pays off because
+    pooled connections live across many calls.
+    """
+
+    def __init__(self, db_path=None, size=5, idle_timeout=300.0, pre_ping=True,
+                 statement_cache_size=128, timeout=30.0):
+        self.db_path = db_path or DB_PATH
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self.statement_cache_size = statement_cache_size
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._condition = threading.Condition()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=self.statement_cache_size, factory=PooledConnection)
+        conn.db_path = self.db_path
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                while self._idle:
+                    conn, last_used = self._idle.pop()
+                    expired = self.idle_timeout is not None and time.monotonic() - last_used > self.idle_timeout
+                    if not expired and (not self.pre_ping or self._is_alive(conn)):
+                        return conn
+                    self._close(conn)
+                    self._open -= 1
+
+                if self._open < self.size:
+                    self._open += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(f"No connection to {self.db_path} available after {self.timeout}s")
+                self._condition.wait(remaining)
+
+        try:
+            return self._connect()
+        except sqlite3.Error:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    def _reset(self, conn):
+        """
+        Undo the settings a caller may have changed, so the next one gets
+        a connection that behaves like a freshly opened one
+        """
+        conn.row_factory = None
+        conn.text_factory = str
+        if conn.isolation_level != '':
+            conn.isolation_level = ''
+        if conn.authorizer_changed:
+            conn.set_authorizer(conn.authorizer)
+
+    def release(self, conn):
+        # like closing a plain connection, uncommitted work is discarded
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._reset(conn)
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._condition:
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._condition:
+            for conn, _ in self._idle:
+                self._close(conn)
+                self._open -= 1
+            self._idle = []
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=None, **options):
+    """
+    Return the shared pool for db_path, creating it with `options` the
+    first time it is asked for
+    """
+    db_path = db_path or DB_PATH
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path, **options)
+        return pool
+
+
+class AsyncConnectionPool:
+    """
+    asyncio counterpart of ConnectionPool built on aiosqlite, with the
+    same size, idle_timeout, pre_ping and statement cache settings.
+    Waiting for a free connection suspends the coroutine instead of
+    blocking the event loop. A pool belongs to the event loop it was
+    first used in but keeps no reference to it, so get_async_pool can
+    stop its connections once that loop is closed or collected.
+    """
+
+    def __init__(self, db_path=None, size=5, idle_timeout=300.0, pre_ping=True,
+                 statement_cache_size=128):
+        if aiosqlite is None:
+            raise RuntimeError("aiosqlite is required to use the decorators on coroutine functions")
+        self.db_path = db_path or DB_PATH
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self.statement_cache_size = statement_cache_size
+        self._idle = []
+        # free connection slots and the coroutines waiting for one, an
+        # asyncio.Semaphore would hold on to the loop
+        self._available = size
+        self._waiters = deque()
+
+    async def _acquire_slot(self):
+        if self._available and not self._waiters:
+            self._available -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # a slot was handed over just as we were cancelled, pass it on
+                self._release_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._available += 1
+
+    async def _is_alive(self, conn):
+        try:
+            async with conn.execute("SELECT 1") as cursor:
+                await cursor.fetchone()
+            return True
+        except (aiosqlite.Error, ValueError):
+            return False
+
+    async def _close(self, conn):
+        try:
+            await conn.close()
+        except (aiosqlite.Error, ValueError):
+            pass
+
+    async def acquire(self):
+        await self._acquire_slot()
+        try:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                expired = self.idle_timeout is not None and time.monotonic() - last_used > self.idle_timeout
+                if not expired and (not self.pre_ping or await self._is_alive(conn)):
+                    return conn
+                await self._close(conn)
+            conn = aiosqlite.connect(self.db_path, cached_statements=self.statement_cache_size,
+                                     factory=PooledConnection)
+            # pooled connections outlive the calls that use them; their worker
+            # thread must not keep the interpreter alive once the program ends
+            # (older aiosqlite versions make the connection itself the thread)
+            getattr(conn, '_thread', conn).daemon = True
+            await conn
+            conn.db_path = self.db_path
+            return conn
+        except BaseException:
+            self._release_slot()
+            raise
+
+    async def release(self, conn):
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+            # same reset as ConnectionPool._reset
+            conn.row_factory = None
+            conn.text_factory = str
+            if conn._connection.authorizer_changed:
+                await conn.set_authorizer(conn._connection.authorizer)
+            self._idle.append((conn, time.monotonic()))
+        except (aiosqlite.Error, ValueError):
+            await self._close(conn)
+        finally:
+            self._release_slot()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await self._close(conn)
+
+    def stop(self):
+        """
+        Stop the idle connections without awaiting, for when the pool's
+        event loop is gone
+        """
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.stop()
+
+
+# event loop -> ({db_path: AsyncConnectionPool}, closer async generator)
+_async_pools = weakref.WeakKeyDictionary()
+
+
+async def _close_at_shutdown(pools):
+    """
+    Async generator parked at its yield for the life of a loop; the
+    shutdown_asyncgens() step of asyncio.run closes it, which closes the
+    loop's pools while the loop can still await them
+    """
+    try:
+        yield
+    finally:
+        for pool in pools.values():
+            await pool.close()
+
+
+def get_async_pool(db_path=None, **options):
+    """
+    Return the shared AsyncConnectionPool for db_path in the running
+    event loop, creating it with `options` the first time. The pools of
+    a loop are closed when asyncio.run shuts it down, or stopped the
+    next time a pool is asked for if the loop was closed some other way.
+    """
+    db_path = db_path or DB_PATH
+    loop = asyncio.get_running_loop()
+    for other, (pools, _) in list(_async_pools.items()):
+        if other.is_closed():
+            del _async_pools[other]
+            for pool in pools.values():
+                pool.stop()
+
+    if loop not in _async_pools:
+        pools = {}
+        closer = _close_at_shutdown(pools)
+        # start it so the loop tracks it and runs its finally block at shutdown
+        asyncio.ensure_future(closer.__anext__())
+        _async_pools[loop] = (pools, closer)
+    pools = _async_pools[loop][0]
+    pool = pools.get(db_path)
+    if pool is None:
+        pool = pools[db_path] = AsyncConnectionPool(db_path, **options)
+    return pool
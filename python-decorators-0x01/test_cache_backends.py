@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from cache_backends import SharedMemoryBackend, fcntl
+
+
+@unittest.skipIf(fcntl is None, "SharedMemoryBackend needs fcntl")
+class TestSharedMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'query_cache.shm')
+        self.first = SharedMemoryBackend(self.path, slots=8, slot_size=4096)
+        self.second = SharedMemoryBackend(self.path, slots=8, slot_size=4096)
+
+    def tearDown(self):
+        self.first.close()
+        self.second.close()
+        os.remove(self.path)
+        os.rmdir(os.path.dirname(self.path))
+
+    def test_instances_lock_each_other_out(self):
+        inside = []
+        entered = threading.Event()
+
+        def hold():
+            with self.first._locked():
+                inside.append('first')
+                entered.set()
+                time.sleep(0.2)
+                inside.append('first done')
+
+        def enter():
+            entered.wait()
+            with self.second._locked():
+                inside.append('second')
+
+        threads = [threading.Thread(target=hold), threading.Thread(target=enter)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(inside, ['first', 'first done', 'second'])
+
+    def test_instances_share_entries(self):
+        key = ('/tmp/users.db', "SELECT name FROM users WHERE id = ?", (1,))
+        self.first.set(key, [('Ada',)], ('users',))
+        self.assertEqual(self.second.get(key), (True, [('Ada',)], False))
+        self.second.invalidate('/tmp/users.db', {'users'})
+        self.assertEqual(self.first.get(key)[0], False)
+
+
+if __name__ == '__main__':
+    unittest.main()
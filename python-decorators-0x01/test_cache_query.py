@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import asyncio
+import importlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+import aiosqlite
+
+from db_pool import get_pool, get_async_pool
+from cache_backends import key_digest
+
+cache_query = importlib.import_module('4-cache_query')
+transactional = importlib.import_module('2-transactional').transactional
+
+
+class TestCacheQuery(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)", [(1, 'Ada'), (2, 'Grace')])
+        conn.commit()
+        conn.close()
+        self.cache = cache_query.QueryCache()
+
+    def tearDown(self):
+        cache_query.query_cache.clear()
+        get_pool(self.db_path).close()
+        os.remove(self.db_path)
+
+    def test_parameters_are_part_of_the_key(self):
+        @cache_query.cache_query(cache=self.cache)
+        def by_id(conn, query, user_id):
+            return conn.execute(query, (user_id,)).fetchone()
+
+        q = "SELECT name FROM users WHERE id = ?"
+        with get_pool(self.db_path).connection() as conn:
+            self.assertEqual(by_id(conn, q, 1), ('Ada',))
+            self.assertEqual(by_id(conn, q, 2), ('Grace',))
+            self.assertEqual(by_id(conn, q, user_id=1), ('Ada',))
+            self.assertEqual(by_id(conn, q, user_id=2), ('Grace',))
+
+    def test_async_parameters_are_part_of_the_key(self):
+        @cache_query.cache_query(cache=self.cache)
+        async def by_id(conn, query, user_id):
+            cursor = await conn.execute(query, (user_id,))
+            return await cursor.fetchone()
+
+        async def main():
+            q = "SELECT name FROM users WHERE id = ?"
+            async with get_async_pool(self.db_path).connection() as conn:
+                return [await by_id(conn, q, 1), await by_id(conn, q, 2)]
+
+        self.assertEqual(asyncio.run(main()), [('Ada',), ('Grace',)])
+
+    def test_unhashable_arguments_bypass_the_cache(self):
+        calls = []
+
+        @cache_query.cache_query(cache=self.cache)
+        def by_ids(conn, query, ids, tags=None):
+            calls.append(ids)
+            return conn.execute(query, ids).fetchall()
+
+        q = "SELECT name FROM users WHERE id IN (?, ?)"
+        with get_pool(self.db_path).connection() as conn:
+            by_ids(conn, q, [1, 2])
+            by_ids(conn, q, [1, 2])
+            by_ids(conn, q, [1, 2], tags={'admin'})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_commit_invalidates_with_cached_statements(self):
+        @cache_query.cache_query
+        def name_of(conn, query, user_id):
+            return conn.execute(query, (user_id,)).fetchone()
+
+        @transactional
+        def rename(conn, user_id, name):
+            conn.execute("UPDATE users SET name = ? WHERE id = ?", (name, user_id))
+
+        q = "SELECT name FROM users WHERE id = ?"
+        with get_pool(self.db_path).connection() as conn:
+            # the UPDATE is prepared and cached before any tracking
+            rename(conn, 1, 'Ada')
+            self.assertEqual(name_of(conn, q, 1), ('Ada',))
+            rename(conn, 1, 'Ada Lovelace')
+            self.assertEqual(name_of(conn, q, 1), ('Ada Lovelace',))
+
+    def test_rolled_back_reads_are_not_cached(self):
+        @cache_query.cache_query
+        def name_of(conn, query, user_id):
+            return conn.execute(query, (user_id,)).fetchone()
+
+        q = "SELECT name FROM users WHERE id = ?"
+
+        @transactional
+        def rename_and_fail(conn, user_id, name):
+            conn.execute("UPDATE users SET name = ? WHERE id = ?", (name, user_id))
+            self.assertEqual(name_of(conn, q, user_id), (name,))
+            raise ValueError("undo")
+
+        with get_pool(self.db_path).connection() as conn:
+            with self.assertRaises(ValueError):
+                rename_and_fail(conn, 1, 'DIRTY')
+            self.assertEqual(name_of(conn, q, 1), ('Ada',))
+
+    def test_connection_passed_by_keyword(self):
+        @cache_query.cache_query(cache=self.cache)
+        def fetch(conn, query):
+            return conn.execute(query).fetchall()
+
+        with get_pool(self.db_path).connection() as conn:
+            self.assertEqual(fetch(conn=conn, query="SELECT COUNT(*) FROM users"), [(2,)])
+            self.assertEqual(fetch(conn=conn, query="SELECT COUNT(*) FROM users"), [(2,)])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_memory_databases_are_not_cached(self):
+        @cache_query.cache_query(cache=self.cache)
+        def fetch(conn, query):
+            return conn.execute(query).fetchall()
+
+        for rows in (1, 2):
+            conn = sqlite3.connect(':memory:')
+            conn.execute("CREATE TABLE users (id INTEGER)")
+            conn.executemany("INSERT INTO users VALUES (?)", [(i,) for i in range(rows)])
+            self.assertEqual(fetch(conn, "SELECT COUNT(*) FROM users"), [(rows,)])
+            conn.close()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_async_connection_outside_the_pool(self):
+        @cache_query.cache_query(cache=self.cache)
+        async def fetch(conn, query):
+            async with conn.execute(query) as cursor:
+                return await cursor.fetchall()
+
+        async def main():
+            async with aiosqlite.connect(self.db_path) as conn:
+                return await fetch(conn, "SELECT COUNT(*) FROM users")
+
+        self.assertEqual(asyncio.run(main()), [(2,)])
+        found, result, _ = self.cache.get((self.db_path, "SELECT COUNT(*) FROM users", ()))
+        self.assertTrue(found)
+        self.assertEqual(result, [(2,)])
+
+    def test_misses_in_two_event_loops(self):
+        @cache_query.cache_query(cache=self.cache)
+        async def slow_count(conn, query):
+            await asyncio.sleep(0.1)
+            async with conn.execute(query) as cursor:
+                return await cursor.fetchall()
+
+        async def main():
+            async with get_async_pool(self.db_path).connection() as conn:
+                return await slow_count(conn, "SELECT COUNT(*) FROM users")
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(asyncio.run(main()))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[(2,)], [(2,)]])
+
+    def test_refresh_keeps_the_row_factory(self):
+        cache = cache_query.QueryCache(ttl=0.05)
+
+        @cache_query.cache_query(cache=cache, stale_while_revalidate=60)
+        def names(conn, query):
+            return conn.execute(query).fetchall()
+
+        q = "SELECT name FROM users ORDER BY id"
+        with get_pool(self.db_path).connection() as conn:
+            conn.row_factory = sqlite3.Row
+            names(conn, q)
+            time.sleep(0.1)
+            self.assertTrue(cache.get((self.db_path, q, ()), 60)[2])
+            names(conn, q)
+        for _ in range(100):
+            found, rows, stale = cache.get((self.db_path, q, ()))
+            if found and not stale:
+                break
+            time.sleep(0.01)
+        self.assertTrue(found)
+        self.assertIsInstance(rows[0], sqlite3.Row)
+
+    def test_digest_tells_argument_layouts_apart(self):
+        q = "SELECT name FROM users WHERE id IN (?, ?)"
+        self.assertNotEqual(key_digest((self.db_path, q, (1, 2))),
+                            key_digest((self.db_path, q, ((1, 2),))))
+        self.assertNotEqual(key_digest((self.db_path, q, (1,))),
+                            key_digest((self.db_path, q, (2,))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import asyncio
+import importlib
+import sqlite3
+import unittest
+
+breakers = importlib.import_module('5-circuit_breaker')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def open_breaker(self, name):
+        """
+        Decorated function whose breaker is half-open on the next call
+        """
+        calls = []
+
+        @breakers.circuit_breaker(name=name, min_calls=1, reset_timeout=0.0)
+        def call(error=None):
+            calls.append(error)
+            if error is not None:
+                raise error
+            return 'ok'
+
+        with self.assertRaises(sqlite3.OperationalError):
+            call(sqlite3.OperationalError('locked'))
+        self.assertEqual(call.breaker.state, breakers.OPEN)
+        return call, calls
+
+    def test_interrupted_trial_releases_slot(self):
+        call, calls = self.open_breaker('test-interrupted')
+        with self.assertRaises(KeyboardInterrupt):
+            call(KeyboardInterrupt())
+
+        self.assertEqual(call(), 'ok')
+        self.assertEqual(call.breaker.state, breakers.CLOSED)
+        self.assertEqual(len(calls), 3)
+
+    def test_cancelled_trial_releases_slot(self):
+        name = 'test-cancelled'
+        call, _ = self.open_breaker(name)
+
+        @breakers.circuit_breaker(name=name)
+        async def slow():
+            await asyncio.sleep(1)
+
+        @breakers.circuit_breaker(name=name)
+        async def fast():
+            return 'ok'
+
+        async def main():
+            task = asyncio.ensure_future(slow())
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await fast()
+
+        self.assertEqual(asyncio.run(main()), 'ok')
+        self.assertEqual(call.breaker.state, breakers.CLOSED)
+
+    def test_failed_trial_opens_again(self):
+        call, _ = self.open_breaker('test-failed')
+        with self.assertRaises(sqlite3.OperationalError):
+            call(sqlite3.OperationalError('locked'))
+        call.breaker.reset_timeout = 30.0
+
+        with self.assertRaises(breakers.CircuitOpenError):
+            call()
+
+
+if __name__ == '__main__':
+    unittest.main()
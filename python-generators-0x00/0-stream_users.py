@@ -1,27 +1,104 @@
 import sqlite3
-from seed import connect_to_prodev
+import json
+import os
+from seed import get_provider
 
 def stream_users():
-    connection = connect_to_prodev()
-    if not connection:
-        return
-    
     try:
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM user_data")
-        
-        for row in cursor:
-            yield row
+        with get_provider().connection() as connection:
+            cursor = connection.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute("SELECT * FROM user_data")
             
-        cursor.close()
-        connection.close()
+            for row in cursor:
+                yield row
+                
+            cursor.close()
         
     except sqlite3.Error as e:
         print(f"Error occurred: {e}")
-        if connection:
-            connection.close()
             
+
+def load_checkpoint(state_path):
+    """
+    Return the last user_id recorded in state_path, or None to start over
+    """
+    try:
+        with open(state_path, 'r', encoding='utf-8') as file:
+            return json.load(file)['last_user_id']
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError) as e:
+        print(f"Ignoring unreadable checkpoint {state_path}: {e}")
+        return None
+
+
+def save_checkpoint(state_path, last_user_id, rows):
+    """
+    Atomically record the last processed user_id, a crash mid-write
+    leaves the previous checkpoint in place
+    """
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'last_user_id': last_user_id, 'rows': rows}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, state_path)
+
+
+def stream_users_checkpointed(state_path, checkpoint_every=1000):
+    """
+    Stream users in user_id order, resuming after the user_id stored in
+    state_path.
+
+    A row counts as processed once the consumer asks for the next one;
+    the key of the last processed row is saved every checkpoint_every
+    rows and when the stream ends. After a crash, at most
+    checkpoint_every rows are delivered again (at-least-once).
+    """
+    last_user_id = load_checkpoint(state_path)
+    rows = 0
+
+    try:
+        with get_provider().connection() as connection:
+            cursor = connection.cursor()
+            cursor.row_factory = sqlite3.Row
+            if last_user_id is None:
+                cursor.execute("SELECT * FROM user_data ORDER BY user_id")
+            else:
+                cursor.execute("SELECT * FROM user_data WHERE user_id > ? ORDER BY user_id", (last_user_id,))
+
+            for row in cursor:
+                yield row
+                rows += 1
+                last_user_id = row['user_id']
+                if rows % checkpoint_every == 0:
+                    save_checkpoint(state_path, last_user_id, rows)
+
+            cursor.close()
+
+        if last_user_id is not None:
+            save_checkpoint(state_path, last_user_id, rows)
+
+    except sqlite3.Error as e:
+        print(f"Error occurred: {e}")
+
+
+def deliver_users(sink, state_path, checkpoint_every=1000):
+    """
+    Feed every user to sink(row), checkpointing as it goes.
+
+    Rows after the last checkpoint are delivered again after a crash. If
+    sink is idempotent, e.g. an upsert keyed on user_id, replays leave
+    no trace and every user takes effect exactly once.
+    Returns the number of rows delivered.
+    """
+    delivered = 0
+    for row in stream_users_checkpointed(state_path, checkpoint_every):
+        sink(row)
+        delivered += 1
+    return delivered
+
             
 if __name__ == "__main__":
     print("Streaming users:")
@@ -1,44 +1,232 @@
 import sqlite3
-from seed import connect_to_prodev
+import operator
+import queue
+import threading
+import time
+from array import array
+from itertools import compress, repeat
+from seed import get_provider, build_user_query, USER_COLUMNS
 
-def stream_users_in_batches(batch_size):
-    connection = connect_to_prodev()
-    if not connection:
-        return
-    
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class ColumnarBatch:
+    """
+    A batch of users stored column by column instead of as a list of dicts.
+
+    Ages live in a NumPy array when NumPy is installed, otherwise in an
+    array('i'); string columns are plain lists. Filters build a mask over
+    one column and apply it to every column.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows, names=USER_COLUMNS):
+        columns = dict(zip(names, zip(*rows))) if rows else {name: () for name in names}
+        batch = {name: list(values) for name, values in columns.items()}
+        if 'age' in batch:
+            if numpy is not None:
+                batch['age'] = numpy.array(batch['age'], dtype=numpy.int64)
+            else:
+                batch['age'] = array('i', batch['age'])
+        return cls(batch)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def mask(self, name, op, value):
+        """
+        Return a boolean mask of rows where `column op value` holds
+        """
+        compare = COMPARISONS[op]
+        column = self.columns[name]
+        if numpy is not None and isinstance(column, numpy.ndarray):
+            return compare(column, value)
+        return list(map(compare, column, repeat(value)))
+
+    def filter(self, mask):
+        """
+        Return a new batch holding only the rows selected by mask
+        """
+        filtered = {}
+        for name, column in self.columns.items():
+            if numpy is not None and isinstance(column, numpy.ndarray):
+                filtered[name] = column[mask]
+            elif isinstance(column, array):
+                filtered[name] = array(column.typecode, compress(column, mask))
+            else:
+                filtered[name] = list(compress(column, mask))
+        return ColumnarBatch(filtered)
+
+    def rows(self):
+        """
+        Iterate over the batch as dicts, like the row mode batches
+        """
+        names = list(self.columns)
+        for values in zip(*(self.columns[name] for name in names)):
+            yield dict(zip(names, values))
+
+
+class PrefetchStats:
+    """
+    Where time went in a prefetched stream: producer_stall is time the
+    reader thread waited for room in the queue, consumer_stall is time
+    the consumer waited for a batch
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.producer_stall = 0.0
+        self.consumer_stall = 0.0
+
+    def __repr__(self):
+        return (f"PrefetchStats(batches={self.batches}, "
+                f"producer_stall={self.producer_stall:.3f}s, "
+                f"consumer_stall={self.consumer_stall:.3f}s)")
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def prefetch_batches(source, depth, stats=None):
+    """
+    Run the `source` generator in a background thread that keeps up to
+    `depth` batches ready in a bounded queue. The reader blocks when the
+    queue is full, so memory stays at depth + 2 batches.
+    """
+    stats = stats if stats is not None else PrefetchStats()
+    batches = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.producer_stall += time.perf_counter() - start
+
+    def produce():
+        try:
+            for batch in source:
+                put(batch)
+                if stop.is_set():
+                    break
+            put(_DONE)
+        except Exception as e:
+            put(_Failure(e))
+        finally:
+            # runs the generator's cleanup in the thread that opened the connection
+            source.close()
+
+    reader = threading.Thread(target=produce, name="batch-prefetch", daemon=True)
+    reader.start()
     try:
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM user_data")
-        
         while True:
-            rows = cursor.fetchmany(batch_size)
-            if not rows:
+            start = time.perf_counter()
+            item = batches.get()
+            stats.consumer_stall += time.perf_counter() - start
+            if item is _DONE:
                 break
-            batch_dict = [dict(row) for row in rows]
-            print(f"fetched {len(batch_dict)} users")
-            yield batch_dict
+            if isinstance(item, _Failure):
+                raise item.error
+            stats.batches += 1
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+def stream_users_in_batches(batch_size, columns=None, where=None, columnar=False, prefetch=0, stats=None):
+    """
+    Yield users batch_size at a time.
+
+    columns and where are compiled into the query by seed.build_user_query,
+    e.g. where=[('age', '>', 25)], so only the matching rows and the
+    requested columns are read from SQLite.
+
+    With prefetch > 0 a background thread reads ahead up to `prefetch`
+    batches while the current one is processed; pass a PrefetchStats as
+    `stats` to see whether the reader or the consumer is the bottleneck.
+    """
+    if prefetch > 0:
+        source = stream_users_in_batches(batch_size, columns, where, columnar)
+        yield from prefetch_batches(source, prefetch, stats)
+        return
+
+    query, params = build_user_query(columns, where)
+    names = tuple(columns) if columns else USER_COLUMNS
+
+    try:
+        with get_provider().connection() as connection:
+            cursor = connection.cursor()
+            if not columnar:
+                cursor.row_factory = sqlite3.Row
+            cursor.execute(query, params)
             
-        cursor.close()
-        connection.close()
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if columnar:
+                    batch = ColumnarBatch.from_rows(rows, names)
+                    print(f"fetched {len(batch)} users")
+                    yield batch
+                    continue
+                batch_dict = [dict(row) for row in rows]
+                print(f"fetched {len(batch_dict)} users")
+                yield batch_dict
+                
+            cursor.close()
         
     except sqlite3.Error as e:
         print(f"Error streaming data from database: {e}")
-        if connection:
-            connection.close()
             
-def batch_processing(batch_size):
+def batch_processing(batch_size, columnar=False, pushdown=True, prefetch=0):
     batch_count = 0
+    # with pushdown SQLite only returns users over 25 and the columns printed below
+    columns = ('name', 'email', 'age') if pushdown else None
+    where = [('age', '>', 25)] if pushdown else None
     
-    for batch in stream_users_in_batches(batch_size):
+    for batch in stream_users_in_batches(batch_size, columns=columns, where=where, columnar=columnar,
+                                         prefetch=prefetch):
         batch_count += 1
         users_over_25 = []
                 
         print(f"Processing batch {batch_count}")
         
-        for user in batch:
-            if user['age'] > 25:
-                users_over_25.append(user)
+        if pushdown:
+            users_over_25 = list(batch.rows()) if columnar else batch
+        elif columnar:
+            users_over_25 = list(batch.filter(batch.mask('age', '>', 25)).rows())
+        else:
+            for user in batch:
+                if user['age'] > 25:
+                    users_over_25.append(user)
                 
         print(f"Users in batch: {len(batch)}")
         print(f"Users over 25 in batch {len(users_over_25)}")
@@ -1,50 +1,141 @@
 import sqlite3
-from seed import connect_to_prodev
+import json
+import base64
+from seed import get_provider
+
+# columns that can be used as the keyset sort key, only those with an index
+# on (sort_key, user_id): the primary key and seed.TUNING_INDEXES
+# idx_user_data_age. Any other key would scan and sort the table per page.
+SORT_KEYS = ('user_id', 'age')
 
 def paginate_users(page_size, offset):
-    connection = connect_to_prodev()
-    if not connection:
-        return []
-    
     try:
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        
-        query = "SELECT * FROM user_data LIMIT ? OFFSET ?"
-        cursor.execute(query, (page_size, offset))
-        
-        rows = cursor.fetchall()
-        users = [dict(row) for row in rows]
-        
-        cursor.close()
-        connection.close()
+        with get_provider().connection() as connection:
+            cursor = connection.cursor()
+            cursor.row_factory = sqlite3.Row
+            
+            query = "SELECT * FROM user_data LIMIT ? OFFSET ?"
+            cursor.execute(query, (page_size, offset))
+            
+            rows = cursor.fetchall()
+            users = [dict(row) for row in rows]
+            
+            cursor.close()
         
         print(f"Got {len(users)} users starting from position {offset}")
         return users
     
     except sqlite3.Error as e:
         print(f"Error: {e}")
-        connection.close()
         return []
     
 
-def lazy_paginate(page_size):
+def encode_cursor(sort_key, last_value, last_user_id):
+    """
+    Pack the position of the last row seen into an opaque resume token
+    """
+    payload = json.dumps({'key': sort_key, 'last': [last_value, last_user_id]})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Unpack a resume token created by encode_cursor
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        sort_key = payload['key']
+        last_value, last_user_id = payload['last']
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid pagination cursor: {cursor!r}") from e
+    return sort_key, last_value, last_user_id
+
+
+class KeysetPaginator:
+    """
+    Walks user_data page by page with keyset (seek) pagination.
+
+    Each page resumes right after the last row of the previous one
+    (WHERE (sort_key, user_id) > (?, ?)) instead of skipping OFFSET rows,
+    so every page costs the same. A single connection is used for the
+    whole walk. After each page, `cursor` holds an opaque token that can
+    be passed back in to resume from that point.
+    """
+
+    def __init__(self, page_size, sort_key='user_id', cursor=None):
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"Unsupported sort key: {sort_key}")
+        self.page_size = page_size
+        self.sort_key = sort_key
+        self.cursor = cursor
+        self._last = None
+
+        if cursor is not None:
+            cursor_key, last_value, last_user_id = decode_cursor(cursor)
+            if cursor_key != sort_key:
+                raise ValueError(f"Cursor was created for sort key {cursor_key}, not {sort_key}")
+            self._last = (last_value, last_user_id)
+
+    def query(self):
+        """
+        SQL for the next page, it depends on whether a position is known
+        """
+        if self.sort_key == 'user_id':
+            # user_id is unique, no tie breaker needed
+            where = "WHERE user_id > ?" if self._last else ""
+            order = "ORDER BY user_id"
+        else:
+            where = f"WHERE ({self.sort_key}, user_id) > (?, ?)" if self._last else ""
+            order = f"ORDER BY {self.sort_key}, user_id"
+        return f"SELECT * FROM user_data {where} {order} LIMIT ?"
+
+    def params(self):
+        if not self._last:
+            return (self.page_size,)
+        if self.sort_key == 'user_id':
+            return (self._last[1], self.page_size)
+        return (self._last[0], self._last[1], self.page_size)
+
+    def advance(self, users):
+        """
+        Move the position past the last user of a page that was just read
+        """
+        last = users[-1]
+        self._last = (last[self.sort_key], last['user_id'])
+        self.cursor = encode_cursor(self.sort_key, *self._last)
+
+    def __iter__(self):
+        try:
+            with get_provider().connection() as connection:
+                while True:
+                    cursor = connection.cursor()
+                    cursor.row_factory = sqlite3.Row
+                    cursor.execute(self.query(), self.params())
+                    users = [dict(row) for row in cursor.fetchall()]
+                    cursor.close()
+
+                    if not users:
+                        break
+
+                    self.advance(users)
+                    yield users
+
+                    if len(users) < self.page_size:
+                        break
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+
+
+def lazy_paginate(page_size, sort_key='user_id', cursor=None):
     """
     Only fetches the next page when needed
     """
-    offset = 0
-    
-    while True:
-        users = paginate_users(page_size, offset)
-        
-        if not users:
-            print("No more users to fetch")
-            break
-        
+    for users in KeysetPaginator(page_size, sort_key=sort_key, cursor=cursor):
         print(f"Here are the next {len(users)} users")
         yield users
-        
-        offset += page_size
+
+    print("No more users to fetch")
         
 if __name__ == "__main__":
     for page in lazy_paginate(page_size=5):
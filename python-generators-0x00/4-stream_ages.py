@@ -1,44 +1,134 @@
 import sqlite3
-from seed import connect_to_prodev
+from seed import get_provider
 
 def stream_user_ages():
-    connection = connect_to_prodev()
-    if not connection:
-        return
-    
     try:
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        cursor.execute("SELECT age FROM user_data")
-        
-        for row in cursor:
-            yield row['age']
+        with get_provider().connection() as connection:
+            cursor = connection.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute("SELECT age FROM user_data")
             
-        print("Finished streaming ages")
-        
-        cursor.close()
-        connection.close()
+            for row in cursor:
+                yield row['age']
+                
+            print("Finished streaming ages")
+            
+            cursor.close()
         
     except sqlite3.Error as e:
         print(f"Error streaming ages from database: {e}")
-        if connection:
-            connection.close()
             
+class AgeAccumulator:
+    """
+    Single pass accumulator for count, sum, mean, variance (Welford),
+    min, max and a histogram of ages grouped into bucket_size wide buckets
+    """
+
+    def __init__(self, bucket_size=10):
+        self.bucket_size = bucket_size
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = {}
+
+    def add(self, age):
+        self.count += 1
+        self.total += age
+        delta = age - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (age - self.mean)
+
+        if self.min is None or age < self.min:
+            self.min = age
+        if self.max is None or age > self.max:
+            self.max = age
+
+        bucket = (age // self.bucket_size) * self.bucket_size
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def result(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.mean if self.count else 0,
+            'variance': self.m2 / self.count if self.count else 0,
+            'min': self.min,
+            'max': self.max,
+            'histogram': dict(sorted(self.histogram.items())),
+        }
+
+
+def _aggregate_in_sqlite(bucket_size):
+    """
+    Count users per distinct age inside SQLite and derive the statistics
+    from those counts, only one row per distinct age crosses into Python.
+    Grouping by the bare column lets SQLite walk an index on age in order
+    instead of sorting buckets in a temporary b-tree.
+    """
+    try:
+        with get_provider().connection() as connection:
+            cursor = connection.execute("SELECT age, COUNT(*) FROM user_data GROUP BY age ORDER BY age")
+            ages = cursor.fetchall()
+            cursor.close()
+    except sqlite3.Error as e:
+        print(f"Error aggregating ages in database: {e}")
+        return None
+
+    count = sum(n for _, n in ages)
+    total = sum(age * n for age, n in ages)
+    total_squares = sum(age * age * n for age, n in ages)
+    mean = total / count if count else 0
+
+    histogram = {}
+    for age, n in ages:
+        bucket = (age // bucket_size) * bucket_size
+        histogram[bucket] = histogram.get(bucket, 0) + n
+
+    return {
+        'count': count,
+        'sum': total,
+        'mean': mean,
+        'variance': total_squares / count - mean * mean if count else 0,
+        'min': ages[0][0] if ages else None,
+        'max': ages[-1][0] if ages else None,
+        'histogram': histogram,
+    }
+
+
+def _aggregate_streaming(predicate, bucket_size):
+    """
+    Compute the age statistics in one pass over stream_user_ages(),
+    keeping only the ages for which predicate(age) is true
+    """
+    accumulator = AgeAccumulator(bucket_size)
+    for age in stream_user_ages():
+        if predicate(age):
+            accumulator.add(age)
+    return accumulator.result()
+
+
+def aggregate_ages(predicate=None, bucket_size=10):
+    """
+    Return count, sum, mean, variance, min, max and an age histogram.
+
+    Without a predicate the work is pushed down into SQLite. A custom
+    predicate cannot be expressed in SQL, so it falls back to streaming
+    the ages through a single pass accumulator.
+    """
+    if predicate is None:
+        return _aggregate_in_sqlite(bucket_size)
+    return _aggregate_streaming(predicate, bucket_size)
+
+
 def average_user_age():
     """
     Calculate average age of users
     """
-    total_age = 0
-    user_count = 0
-    
-    for age in stream_user_ages():
-        total_age += age
-        user_count += 1
-        
-    if user_count == 0:
-        average_age = 0
-    else:
-        average_age = total_age / user_count
+    stats = aggregate_ages()
+    average_age = stats['mean'] if stats else 0
         
     print(f"Average age of users: average age = {average_age:.2f}")
     
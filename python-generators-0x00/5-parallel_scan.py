@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import seed
+from seed import build_user_query, connect_read_only, USER_COLUMNS
+
+
+def rowid_ranges(db_path, parts):
+    """
+    Split the rowids of user_data into `parts` contiguous inclusive ranges
+    """
+    connection = connect_read_only(db_path)
+    try:
+        low, high = connection.execute("SELECT MIN(rowid), MAX(rowid) FROM user_data").fetchone()
+    finally:
+        connection.close()
+
+    if low is None:
+        return []
+
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def scan_range(db_path, low, high, batch_fn, batch_size, columns, where):
+    """
+    Stream one rowid range from a read-only connection and return
+    the result of batch_fn for each batch, in rowid order
+    """
+    where = list(where or ()) + [('rowid', '>=', low), ('rowid', '<=', high)]
+    query, params = build_user_query(columns, where)
+    names = tuple(columns) if columns else USER_COLUMNS
+
+    connection = connect_read_only(db_path)
+    try:
+        cursor = connection.execute(query + " ORDER BY rowid", params)
+        results = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            results.append(batch_fn([dict(zip(names, row)) for row in rows]))
+        cursor.close()
+        return results
+    finally:
+        connection.close()
+
+
+def parallel_scan(batch_fn, workers=None, batch_size=1000, columns=None, where=None,
+                  ordered=True, db_path=None, ranges_per_worker=4):
+    """
+    Scan user_data across worker processes and yield batch_fn(batch)
+    for every batch.
+
+    The table is split into rowid ranges, each streamed by a worker from
+    its own read-only, memory-mapped connection. batch_fn receives a list of dicts, like
+    stream_users_in_batches yields, and must be a module level function
+    so it can be sent to the workers. columns and where are pushed down
+    as in seed.build_user_query. With ordered=True results come back in
+    rowid order, otherwise as soon as each range finishes.
+    """
+    db_path = os.path.abspath(db_path or seed.DB_NAME)
+    workers = workers or os.cpu_count() or 1
+    ranges = rowid_ranges(db_path, workers * ranges_per_worker)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(scan_range, db_path, low, high, batch_fn, batch_size, columns, where)
+            for low, high in ranges
+        ]
+        try:
+            for future in (futures if ordered else as_completed(futures)):
+                for result in future.result():
+                    yield result
+        finally:
+            # the consumer may stop early, don't scan ranges nobody will read
+            for future in futures:
+                future.cancel()
+
+
+def users_over_25(batch):
+    """
+    Per batch function used by the example below
+    """
+    return [user for user in batch if user['age'] > 25]
+
+
+if __name__ == "__main__":
+    total = 0
+    for users in parallel_scan(users_over_25, workers=4, batch_size=5):
+        total += len(users)
+        for user in users:
+            print(f"User: {user['name']} - Age: {user['age']}")
+    print(f"Users over 25: {total}")
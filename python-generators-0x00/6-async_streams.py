@@ -0,0 +1,114 @@
+import asyncio
+import importlib
+from contextlib import suppress
+import aiosqlite
+import seed
+from seed import build_user_query, USER_COLUMNS
+
+KeysetPaginator = importlib.import_module('2-lazy_paginate').KeysetPaginator
+
+
+async def _read_ahead(fetch):
+    """
+    Yield the results of `await fetch()` until one is empty, always
+    starting the next fetch before handing the current result over,
+    so the database works while the consumer processes
+    """
+    pending = asyncio.ensure_future(fetch())
+    try:
+        while True:
+            result = await pending
+            if not result:
+                break
+            pending = asyncio.ensure_future(fetch())
+            yield result
+    finally:
+        if not pending.done():
+            pending.cancel()
+            with suppress(asyncio.CancelledError, aiosqlite.Error):
+                await pending
+
+
+async def astream_users(read_ahead=1000):
+    """
+    async version of stream_users, yields one row at a time while the
+    next read_ahead rows are fetched in the background
+    """
+    try:
+        async with aiosqlite.connect(seed.DB_NAME) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute("SELECT * FROM user_data") as cursor:
+                async for rows in _read_ahead(lambda: cursor.fetchmany(read_ahead)):
+                    for row in rows:
+                        yield row
+
+    except aiosqlite.Error as e:
+        print(f"Error occurred: {e}")
+
+
+async def astream_users_in_batches(batch_size, columns=None, where=None):
+    """
+    async version of stream_users_in_batches, batch N+1 is fetched
+    while batch N is being processed
+    """
+    query, params = build_user_query(columns, where)
+    names = tuple(columns) if columns else USER_COLUMNS
+
+    try:
+        async with aiosqlite.connect(seed.DB_NAME) as db:
+            async with db.execute(query, params) as cursor:
+                async for rows in _read_ahead(lambda: cursor.fetchmany(batch_size)):
+                    yield [dict(zip(names, row)) for row in rows]
+
+    except aiosqlite.Error as e:
+        print(f"Error streaming data from database: {e}")
+
+
+async def alazy_paginate(page_size, sort_key='user_id', cursor=None):
+    """
+    async version of lazy_paginate using the same keyset pagination,
+    the next page is requested as soon as the current one is known
+    """
+    paginator = KeysetPaginator(page_size, sort_key=sort_key, cursor=cursor)
+    exhausted = False
+
+    try:
+        async with aiosqlite.connect(seed.DB_NAME) as db:
+            db.row_factory = aiosqlite.Row
+
+            async def fetch_page():
+                if exhausted:
+                    return []
+                async with db.execute(paginator.query(), paginator.params()) as page_cursor:
+                    return [dict(row) for row in await page_cursor.fetchall()]
+
+            async def next_page():
+                nonlocal exhausted
+                users = await fetch_page()
+                if users:
+                    paginator.advance(users)
+                # a short page is the last one, skip the empty query after it
+                exhausted = len(users) < page_size
+                return users
+
+            async for users in _read_ahead(next_page):
+                yield users
+
+    except aiosqlite.Error as e:
+        print(f"Error: {e}")
+
+
+async def main():
+    async for page in alazy_paginate(page_size=5):
+        print("Processing this page:")
+        for user in page:
+            print(f"Name: {user['name']} Age: {user['age']}")
+
+    count = 0
+    async for _ in astream_users():
+        count += 1
+    print(f"Streamed {count} users")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,348 @@
+"""
+Benchmarks for the python-generators-0x00 streaming functions.
+
+Each benchmark runs against its own database file so ALX_prodev.db is
+never touched. A --db file that already holds users and was not created
+by this script is refused unless --overwrite is given. Examples:
+
+    python benchmark.py aggregate --rows 10000000
+    python benchmark.py suite --sizes 10000 1000000 --output before.json
+    python benchmark.py compare before.json after.json
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import seed
+
+# generator name -> (module, function, takes a batch/page size)
+GENERATORS = {
+    'stream_users': ('0-stream_users', 'stream_users', False),
+    'stream_users_in_batches': ('1-batch_processing', 'stream_users_in_batches', True),
+    'lazy_paginate': ('2-lazy_paginate', 'lazy_paginate', True),
+    'stream_user_ages': ('4-stream_ages', 'stream_user_ages', False),
+}
+
+
+# PRAGMA application_id of the databases populate() creates ('ALXB')
+BENCHMARK_APPLICATION_ID = 0x414C5842
+
+
+def populate(db_path, rows):
+    """
+    Fill user_data with `rows` deterministic synthetic users from seed
+    """
+    connection = sqlite3.connect(db_path)
+    seed.create_table(connection)
+    connection.execute("DELETE FROM user_data")
+    connection.execute(f"PRAGMA application_id = {BENCHMARK_APPLICATION_ID}")
+    connection.commit()
+    seed.seed_synthetic_users(connection, rows, seed=0)
+    seed.tune_schema(connection)
+    connection.close()
+
+
+def prepare_database(rows, db_path=None, overwrite=False):
+    """
+    Point seed at a benchmark database holding `rows` users,
+    reusing it if it already has the right size. Raises ValueError
+    instead of emptying a database with users that populate() did not
+    create, unless overwrite is True.
+    """
+    if db_path is None:
+        db_path = os.path.join(tempfile.gettempdir(), f"alx_prodev_bench_{rows}.db")
+
+    existing = 0
+    ours = True
+    if os.path.exists(db_path):
+        connection = sqlite3.connect(db_path)
+        try:
+            ours = connection.execute("PRAGMA application_id").fetchone()[0] == BENCHMARK_APPLICATION_ID
+            existing = connection.execute("SELECT COUNT(*) FROM user_data").fetchone()[0]
+        except sqlite3.Error:
+            existing = 0
+        connection.close()
+
+    if existing != rows:
+        if existing and not ours and not overwrite:
+            raise ValueError(f"{db_path} already holds {existing} users that this benchmark did not create, "
+                             f"use --overwrite to replace them")
+        print(f"Populating {db_path} with {rows} users")
+        populate(db_path, rows)
+
+    seed.DB_NAME = db_path
+    return db_path
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_aggregate(rows, repeat=3):
+    """
+    Compare the SQLite pushdown path of aggregate_ages with the
+    streaming Welford fallback used for custom predicates
+    """
+    stream_ages = importlib.import_module('4-stream_ages')
+
+    paths = {
+        'pushdown': lambda: stream_ages.aggregate_ages(),
+        'streaming': lambda: stream_ages.aggregate_ages(predicate=lambda age: True),
+    }
+
+    results = {}
+    for name, run in paths.items():
+        best = min(timed(run)[0] for _ in range(repeat))
+        results[name] = {'seconds': best, 'rows_per_sec': rows / best if best else 0}
+        print(f"{name:<10} {best:8.3f}s {results[name]['rows_per_sec']:>14,.0f} rows/sec")
+    return results
+
+
+def drop_page_cache(db_path):
+    """
+    Ask the kernel to evict the database file from the page cache so the
+    next scan is cold. Only supported where posix_fadvise exists.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(db_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def full_scan(connection):
+    count = 0
+    for _ in connection.execute("SELECT * FROM user_data"):
+        count += 1
+    return count
+
+
+def bench_mmap(rows, db_path, repeat=3):
+    """
+    Cold and warm full scans with the default read-write connection and
+    with seed.connect_read_only (mode=ro, immutable, mmap)
+    """
+    modes = {
+        'default': lambda: sqlite3.connect(db_path),
+        'read_only': lambda: seed.connect_read_only(db_path, mmap_size=0),
+        'mmap': lambda: seed.connect_read_only(db_path, immutable=True),
+    }
+
+    results = {}
+    for name, connect in modes.items():
+        cold = []
+        warm = []
+        for _ in range(repeat):
+            cache_dropped = drop_page_cache(db_path)
+            connection = connect()
+            cold.append(timed(full_scan, connection)[0])
+            warm.append(timed(full_scan, connection)[0])
+            connection.close()
+        results[name] = {'cold_seconds': min(cold), 'warm_seconds': min(warm),
+                         'page_cache_dropped': cache_dropped}
+        print(f"{name:<10} cold {min(cold):8.3f}s ({rows / min(cold):>12,.0f} rows/sec)  "
+              f"warm {min(warm):8.3f}s ({rows / min(warm):>12,.0f} rows/sec)")
+    return results
+
+
+def count_users_over_25(batch):
+    return sum(1 for user in batch if user['age'] > 25)
+
+
+def bench_parallel(rows, workers=(1, 2, 4, 8, 16), batch_size=10000):
+    """
+    Scaling of 5-parallel_scan.parallel_scan with the worker count,
+    running the batch_processing age filter in the workers
+    """
+    parallel = importlib.import_module('5-parallel_scan')
+
+    results = {}
+    for count in workers:
+        seconds, matched = timed(
+            lambda: sum(parallel.parallel_scan(count_users_over_25, workers=count,
+                                               batch_size=batch_size, ordered=False))
+        )
+        results[count] = {'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0}
+        base = results[workers[0]]['seconds']
+        print(f"{count:>3} workers {seconds:8.3f}s {results[count]['rows_per_sec']:>14,.0f} rows/sec "
+              f"speedup {base / seconds:5.2f}x ({matched} matched)")
+    return results
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def run_case(generator, batch_size, db_path):
+    """
+    Consume one generator to the end and measure it. Runs in its own
+    process (see measure_case) so peak RSS belongs to this case only.
+    """
+    module_name, function_name, sized = GENERATORS[generator]
+    seed.DB_NAME = db_path
+    function = getattr(importlib.import_module(module_name), function_name)
+    rss_before = peak_rss_kb()
+
+    rows = 0
+    first_row = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for item in (function(batch_size) if sized else function()):
+            if first_row is None:
+                first_row = time.perf_counter() - start
+            rows += len(item) if sized else 1
+        seconds = time.perf_counter() - start
+
+    return {
+        'generator': generator,
+        'batch_size': batch_size if sized else None,
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else 0,
+        'time_to_first_row': first_row,
+        'peak_rss_kb': peak_rss_kb(),
+        'rss_growth_kb': peak_rss_kb() - rss_before,
+    }
+
+
+def measure_case(generator, batch_size, db_path):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '_case', '--generator', generator,
+         '--batch-size', str(batch_size), '--db', db_path],
+        check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(sizes, batch_sizes, db_dir=None, overwrite=False):
+    """
+    Measure every generator at every table size and batch size
+    """
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    results = []
+    for size in sizes:
+        db_path = None
+        if db_dir:
+            db_path = os.path.join(db_dir, f"alx_prodev_bench_{size}.db")
+        db_path = prepare_database(size, db_path, overwrite)
+
+        for generator, (_, _, sized) in GENERATORS.items():
+            for batch_size in (batch_sizes if sized else [0]):
+                result = measure_case(generator, batch_size, db_path)
+                result['table_rows'] = size
+                results.append(result)
+                label = f"{generator}({batch_size})" if sized else generator
+                print(f"{size:>10} {label:<32} {result['rows_per_sec']:>12,.0f} rows/sec  "
+                      f"first row {result['time_to_first_row'] or 0:.4f}s  "
+                      f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MB")
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def result_key(result):
+    return (result['table_rows'], result['generator'], result['batch_size'])
+
+
+def compare(old_path, new_path):
+    """
+    Print the rows/sec and peak RSS change of every case found in both files
+    """
+    with open(old_path, encoding='utf-8') as file:
+        old = {result_key(r): r for r in json.load(file)['results']}
+    with open(new_path, encoding='utf-8') as file:
+        new = {result_key(r): r for r in json.load(file)['results']}
+
+    for key in sorted(old.keys() & new.keys(), key=str):
+        before, after = old[key], new[key]
+        speed = after['rows_per_sec'] / before['rows_per_sec'] if before['rows_per_sec'] else 0
+        label = f"{key[1]}({key[2]})" if key[2] is not None else key[1]
+        print(f"{key[0]:>10} {label:<32} rows/sec x{speed:5.2f}  "
+              f"peak RSS {before['peak_rss_kb'] / 1024:.1f} -> {after['peak_rss_kb'] / 1024:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmark', choices=['aggregate', 'parallel', 'mmap', 'suite', 'compare', '_case'])
+    parser.add_argument('files', nargs='*', help="result files for compare")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--db', help="database file to use instead of a temporary one")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="replace the users of a --db file this script did not create")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--db-dir', help="directory for the suite databases")
+    parser.add_argument('--output', help="write suite results as JSON to this file")
+    parser.add_argument('--generator', choices=list(GENERATORS))
+    parser.add_argument('--batch-size', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.benchmark == '_case':
+        print(json.dumps(run_case(args.generator, args.batch_size, args.db)))
+        return
+    if args.benchmark == 'compare':
+        if len(args.files) != 2:
+            parser.error("compare needs two result files")
+        compare(*args.files)
+        return
+    if args.benchmark == 'suite':
+        try:
+            report = bench_suite(args.sizes, args.batch_sizes, args.db_dir, args.overwrite)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+            print(f"Results written to {args.output}")
+        return
+
+    try:
+        db_path = prepare_database(args.rows, args.db, args.overwrite)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.benchmark == 'aggregate':
+        bench_aggregate(args.rows, args.repeat)
+    elif args.benchmark == 'parallel':
+        bench_parallel(args.rows, tuple(args.workers))
+    elif args.benchmark == 'mmap':
+        bench_mmap(args.rows, db_path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,58 @@
 import sqlite3
 import csv
+import hashlib
 import uuid
 import os
-from typing import Generator, Dict, Any
+import random
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import Generator, Dict, Any, Iterable, Iterator, List, Tuple
+
+DB_NAME = 'ALX_prodev.db'
+
+USER_COLUMNS = ('user_id', 'name', 'email', 'age')
+
+# columns that can be filtered on but are not part of a user row
+FILTER_ONLY_COLUMNS = ('rowid',)
+
+SQL_OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'IN')
+
+# pragmas applied to every connection opened by ConnectionProvider
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+# pragmas for read-only connections, journal_mode cannot be changed there
+READ_ONLY_PRAGMAS = {
+    'mmap_size': 1024 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+# pragmas applied for the duration of a bulk load
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
+
+# builds a random version 4 UUID inside SQLite so the loader does not
+# have to call uuid.uuid4() for every row
+SQL_UUID4 = (
+    "lower(hex(randomblob(4))) || '-' || lower(hex(randomblob(2))) || '-4' || "
+    "substr(lower(hex(randomblob(2))), 2) || '-' || "
+    "substr('89ab', 1 + (abs(random()) % 4), 1) || "
+    "substr(lower(hex(randomblob(2))), 2) || '-' || lower(hex(randomblob(6)))"
+)
 
 def connect_db():
     try:
-        connection = sqlite3.connect('ALX_prodev.db')
+        connection = sqlite3.connect(DB_NAME)
         print("Successfully connected to SQLite database")
         return connection
     except sqlite3.Error as e:
@@ -19,15 +65,258 @@ def create_database(connection):
     except sqlite3.Error as e:
         print(f"Error with database: {e}")
         
-def connect_to_prodev():
+def connect_to_prodev(quiet=False):
     try:
-        connection = sqlite3.connect('ALX_prodev.db')
-        print("Successfully connected to ALX_prodev database")    
+        connection = sqlite3.connect(DB_NAME)
+        if not quiet:
+            print("Successfully connected to ALX_prodev database")    
         return connection
     except sqlite3.Error as e:
         print(f"Error connecting to ALX_prodev database: {e}")
         return None
     
+def read_only_uri(path, immutable=False):
+    """
+    Build the URI that opens path read-only, optionally as immutable
+    """
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return uri
+
+def has_pending_writes(path):
+    """
+    True if path has a hot journal or a non-empty WAL next to it, in
+    which case opening it as immutable would miss committed data
+    """
+    for suffix in ('-journal', '-wal'):
+        side_file = path + suffix
+        if os.path.exists(side_file) and os.path.getsize(side_file) > 0:
+            return True
+    return False
+
+def connect_read_only(db_name=None, immutable=False, mmap_size=READ_ONLY_PRAGMAS['mmap_size'],
+                      check_same_thread=True):
+    """
+    Open the database read-only with memory-mapped I/O.
+
+    With immutable=True SQLite skips all locking and change detection.
+    Only ask for it when nothing writes to the file while it is open;
+    it is ignored if the database still has a hot journal or WAL.
+    """
+    path = db_name or DB_NAME
+    if immutable and has_pending_writes(path):
+        print(f"{path} has uncommitted journal data, opening without immutable")
+        immutable = False
+
+    connection = sqlite3.connect(read_only_uri(path, immutable), uri=True,
+                                 check_same_thread=check_same_thread)
+    connection.execute(f"PRAGMA mmap_size = {mmap_size}")
+    return connection
+
+class ConnectionProvider:
+    """
+    Process wide source of SQLite connections for the generators.
+
+    A thread asking for a connection while it already holds one to the
+    same database gets that connection back, so nested generators share
+    it. At most
+    max_connections are open at once; a thread that finds none available
+    waits up to `timeout` seconds. Idle connections are validated with a
+    cheap query before being handed out again. Connections are opened
+    with check_same_thread=False because they move between threads
+    through the idle list, but each one is only used by one thread at a
+    time.
+
+    read_only=True opens connections through connect_read_only, for scan
+    heavy jobs on a database nothing else is writing to.
+    """
+
+    def __init__(self, db_name=None, max_connections=8, pragmas=None, quiet=True, timeout=30.0,
+                 read_only=False, immutable=False):
+        # when db_name is None the provider follows seed.DB_NAME
+        self.db_name = db_name
+        self.max_connections = max_connections
+        self.read_only = read_only
+        self.immutable = immutable
+        if pragmas is None:
+            pragmas = READ_ONLY_PRAGMAS if read_only else DEFAULT_PRAGMAS
+        self.pragmas = pragmas
+        self.quiet = quiet
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._leases = {}
+        self._open = 0
+
+    def _check_fork(self):
+        # connections inherited from a parent process must not be reused
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _path(self):
+        return self.db_name or DB_NAME
+
+    def _open_connection(self, path):
+        if self.read_only:
+            connection = connect_read_only(path, immutable=self.immutable, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        if not self.quiet:
+            print(f"Successfully connected to {path}")
+        return connection
+
+    def _is_healthy(self, connection):
+        try:
+            connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self):
+        """
+        Return a connection for the calling thread, reusing the one it
+        already holds if any. Every acquire needs a matching release.
+        """
+        path = self._path()
+        # a thread holds one lease per database, the path can change between calls
+        lease_key = (threading.get_ident(), path)
+        deadline = time.monotonic() + self.timeout
+
+        with self._condition:
+            self._check_fork()
+
+            lease = self._leases.get(lease_key)
+            if lease:
+                lease[2] += 1
+                return lease[1]
+
+            while True:
+                while self._idle:
+                    idle_path, connection = self._idle.pop()
+                    if idle_path == path and self._is_healthy(connection):
+                        self._leases[lease_key] = [path, connection, 1]
+                        return connection
+                    self._close(connection)
+                    self._open -= 1
+
+                if self._open < self.max_connections:
+                    self._open += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"No connection available after {self.timeout}s "
+                        f"({self.max_connections} in use)"
+                    )
+                self._condition.wait(remaining)
+
+        try:
+            connection = self._open_connection(path)
+        except sqlite3.Error:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._leases[lease_key] = [path, connection, 1]
+        return connection
+
+    def release(self, connection):
+        """
+        Give back a connection obtained from acquire
+        """
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            for lease_key, lease in self._leases.items():
+                if lease[1] is connection:
+                    break
+            else:
+                return
+
+            lease[2] -= 1
+            if lease[2] > 0:
+                return
+            del self._leases[lease_key]
+
+            if connection.in_transaction:
+                connection.rollback()
+            connection.row_factory = None
+            self._idle.append((lease[0], connection))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def health_check(self):
+        """
+        Return True if a connection can be obtained and queried
+        """
+        try:
+            with self.connection() as connection:
+                return self._is_healthy(connection)
+        except sqlite3.Error as e:
+            if not self.quiet:
+                print(f"Health check failed: {e}")
+            return False
+
+    def close_all(self):
+        """
+        Close every idle connection
+        """
+        with self._condition:
+            self._check_fork()
+            for _, connection in self._idle:
+                self._close(connection)
+                self._open -= 1
+            self._idle = []
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_provider():
+    """
+    Return the process wide ConnectionProvider, creating it on first use
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = ConnectionProvider()
+        return _provider
+
+def configure_provider(**kwargs):
+    """
+    Replace the process wide ConnectionProvider, e.g.
+    configure_provider(max_connections=4, quiet=False)
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is not None:
+            _provider.close_all()
+        _provider = ConnectionProvider(**kwargs)
+        return _provider
+
 def create_table(connection):
     try:
         cursor = connection.cursor()
@@ -42,8 +331,7 @@ def create_table(connection):
         """
     
         cursor.execute(create_table_query)
-        #creates index on user_id
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON user_data(user_id)")
+        # user_id is the primary key and already has an index
         
         connection.commit()
         print("Table user_data created sucessfully")
@@ -88,6 +376,450 @@ def insert_data(connection, csv_file_path):
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         
+def read_csv_chunks(csv_file_path, chunk_size) -> Iterator[List[Tuple[str, str, int]]]:
+    """
+    Stream (name, email, age) tuples from a CSV file, chunk_size rows at a time.
+    Only the current chunk is held in memory.
+    """
+    with open(csv_file_path, 'r', newline='', encoding='utf-8') as file:
+        rows = ((row['name'], row['email'], int(row['age'])) for row in csv.DictReader(file))
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+def set_pragmas(connection, pragmas) -> Dict[str, Any]:
+    """
+    Apply pragmas to a connection and return their previous values
+    so they can be restored afterwards.
+    """
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = connection.execute(f"PRAGMA {name}").fetchone()[0]
+        connection.execute(f"PRAGMA {name} = {value}")
+    return previous
+
+def bulk_insert_rows(connection, chunks: Iterable[List[Tuple]], generate_ids=True) -> int:
+    """
+    Insert chunks of (name, email, age) rows, one executemany and one
+    transaction per chunk. user_id is generated by SQLite, unless
+    generate_ids is False and rows are (user_id, name, email, age).
+    Returns the number of rows actually inserted, rows ignored as
+    duplicates are not counted.
+    """
+    user_id = SQL_UUID4 if generate_ids else "?"
+    insert_query = f"""
+    INSERT OR IGNORE INTO user_data (user_id, name, email, age)
+    VALUES ({user_id}, ?, ?, ?)
+    """
+    records_inserted = 0
+    cursor = connection.cursor()
+    try:
+        for chunk in chunks:
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany(insert_query, chunk)
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            # executemany sums the rows changed by every execution
+            inserted = cursor.rowcount
+            cursor.execute("COMMIT")
+            records_inserted += inserted
+    finally:
+        cursor.close()
+    return records_inserted
+
+def bulk_insert_data(connection, csv_file_path, chunk_size=50000):
+    """
+    Bulk load a CSV file into user_data.
+
+    The file is streamed in chunks of chunk_size rows so memory stays flat
+    no matter how big the file is. WAL journaling and synchronous=NORMAL
+    are enabled for the load and synchronous is restored afterwards.
+    Returns the number of rows inserted. If a chunk fails, the chunks
+    before it stay committed and their row count is returned.
+    """
+    if not os.path.exists(csv_file_path):
+        print(f"CSV file {csv_file_path} not found")
+        return 0
+
+    isolation_level = connection.isolation_level
+    previous = {}
+    records_inserted = 0
+    try:
+        # manage transactions explicitly, one per chunk
+        connection.isolation_level = None
+        previous = set_pragmas(connection, BULK_LOAD_PRAGMAS)
+
+        start = time.perf_counter()
+        for chunk in read_csv_chunks(csv_file_path, chunk_size):
+            records_inserted += bulk_insert_rows(connection, [chunk])
+        elapsed = time.perf_counter() - start
+
+        rate = records_inserted / elapsed if elapsed else 0
+        print(f"Bulk loaded {records_inserted} records in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+
+    except sqlite3.Error as e:
+        print(f"Error inserting data: {e} ({records_inserted} records committed before the error)")
+    except Exception as e:
+        print(f"Error reading CSV file: {e} ({records_inserted} records committed before the error)")
+    finally:
+        # journal_mode=WAL is persistent and safe to keep, synchronous is per connection
+        if 'synchronous' in previous:
+            connection.execute(f"PRAGMA synchronous = {previous['synchronous']}")
+        connection.isolation_level = isolation_level
+    return records_inserted
+
+def create_sync_tables(connection):
+    """
+    Tables used by sync_data: the last seen hash of every email and how
+    far into each CSV file the sync got. Also makes email unique in
+    user_data, which the upsert needs.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_data_sync (
+        email TEXT PRIMARY KEY,
+        row_hash TEXT NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS csv_sync_state (
+        csv_path TEXT PRIMARY KEY,
+        header TEXT NOT NULL,
+        byte_offset INTEGER NOT NULL,
+        prefix_hash TEXT
+    )
+    """)
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(csv_sync_state)")]
+    if 'prefix_hash' not in columns:
+        # state saved before prefix hashes were recorded is never trusted
+        cursor.execute("ALTER TABLE csv_sync_state ADD COLUMN prefix_hash TEXT")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_data_email ON user_data(email)")
+    connection.commit()
+    cursor.close()
+
+def row_hash(name, age):
+    return hashlib.blake2b(f"{name}\x1f{age}".encode('utf-8'), digest_size=8).hexdigest()
+
+def hash_prefix(csv_file_path, length):
+    """
+    sha256 object fed with the first `length` bytes of the file
+    """
+    digest = hashlib.sha256()
+    with open(csv_file_path, 'rb') as file:
+        while length > 0:
+            block = file.read(min(length, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            length -= len(block)
+    return digest
+
+def read_csv_from_offset(csv_file_path, offset, chunk_size, digest=None) -> Iterator[Tuple[List[Tuple[str, str, int]], int]]:
+    """
+    Stream a CSV file starting at byte `offset`, yielding chunks of
+    (name, email, age) rows together with the byte offset just past the
+    chunk. Starts after the header when offset is 0. Every byte read
+    (the header too when offset is 0) is fed to `digest` if given, so at
+    each yield it covers the file up to the returned offset.
+    """
+    with open(csv_file_path, 'rb') as file:
+        header_line = file.readline()
+        header = next(csv.reader([header_line.decode('utf-8')]))
+        if offset:
+            file.seek(offset)
+        elif digest is not None:
+            digest.update(header_line)
+
+        chunk = []
+        while True:
+            line = file.readline()
+            # a quoted field may contain newlines, keep reading until quotes balance
+            while line.count(b'"') % 2:
+                more = file.readline()
+                if not more:
+                    break
+                line += more
+            if not line:
+                break
+            if digest is not None:
+                digest.update(line)
+            if line.strip():
+                row = dict(zip(header, next(csv.reader([line.decode('utf-8')]))))
+                chunk.append((row['name'], row['email'], int(row['age'])))
+            if len(chunk) >= chunk_size:
+                yield chunk, file.tell()
+                chunk = []
+        if chunk:
+            yield chunk, file.tell()
+
+def _sync_chunk(cursor, chunk):
+    """
+    Upsert one chunk inside the current transaction, return
+    (inserted, updated, skipped)
+    """
+    cursor.execute("DELETE FROM temp.sync_batch")
+    # later rows for the same email win
+    cursor.executemany(
+        "INSERT OR REPLACE INTO temp.sync_batch (email, name, age, row_hash, status) VALUES (?, ?, ?, ?, 'new')",
+        [(email, name, age, row_hash(name, age)) for name, email, age in chunk],
+    )
+    # rows loaded before sync_data existed have no hash yet, compare their values instead
+    cursor.execute("""
+    UPDATE temp.sync_batch SET status = CASE
+        WHEN s.row_hash IS NULL AND (u.name IS NOT sync_batch.name OR u.age IS NOT sync_batch.age) THEN 'changed'
+        WHEN s.row_hash IS NULL THEN 'unhashed'
+        WHEN s.row_hash != sync_batch.row_hash THEN 'changed'
+        ELSE 'same'
+    END
+    FROM user_data AS u
+    LEFT JOIN user_data_sync AS s ON s.email = u.email
+    WHERE u.email = sync_batch.email
+    """)
+    cursor.execute(f"""
+    INSERT INTO user_data (user_id, name, email, age)
+    SELECT {SQL_UUID4}, name, email, age FROM temp.sync_batch WHERE status IN ('new', 'changed')
+    ON CONFLICT(email) DO UPDATE SET name = excluded.name, age = excluded.age
+    """)
+    cursor.execute("""
+    INSERT INTO user_data_sync (email, row_hash)
+    SELECT email, row_hash FROM temp.sync_batch WHERE status != 'same'
+    ON CONFLICT(email) DO UPDATE SET row_hash = excluded.row_hash
+    """)
+    counts = dict(cursor.execute("SELECT status, COUNT(*) FROM temp.sync_batch GROUP BY status").fetchall())
+    inserted = counts.get('new', 0)
+    updated = counts.get('changed', 0)
+    return inserted, updated, len(chunk) - inserted - updated
+
+def sync_data(connection, csv_file_path, chunk_size=5000):
+    """
+    Incrementally sync a CSV file into user_data, keyed on email.
+
+    Only new emails are inserted and only rows whose name or age changed
+    are updated; a hash per email is kept in user_data_sync so unchanged
+    rows cost one lookup. The byte offset reached in the file and a hash
+    of the bytes before it are saved with every chunk, so a re-run after
+    the file was only appended to reads just the new lines. If anything
+    before the offset changed, e.g. the file was rewritten by a new
+    export, the whole file is compared against the row hashes again.
+    Returns a dict with inserted, updated and skipped counts.
+    """
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    if not os.path.exists(csv_file_path):
+        print(f"CSV file {csv_file_path} not found")
+        return counts
+
+    path = os.path.abspath(csv_file_path)
+    isolation_level = connection.isolation_level
+    cursor = connection.cursor()
+    try:
+        create_sync_tables(connection)
+        connection.isolation_level = None
+        cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sync_batch (
+            email TEXT PRIMARY KEY, name TEXT, age INTEGER, row_hash TEXT, status TEXT
+        )
+        """)
+
+        with open(path, 'rb') as file:
+            header = file.readline().decode('utf-8').strip()
+        state = cursor.execute(
+            "SELECT header, byte_offset, prefix_hash FROM csv_sync_state WHERE csv_path = ?", (path,)
+        ).fetchone()
+        offset = 0
+        digest = hashlib.sha256()
+        if state and state[0] == header and state[2] and state[1] <= os.path.getsize(path):
+            prefix = hash_prefix(path, state[1])
+            if prefix.hexdigest() == state[2]:
+                offset, digest = state[1], prefix
+            else:
+                print(f"{csv_file_path} changed before byte {state[1]}, comparing the whole file")
+
+        for chunk, end_offset in read_csv_from_offset(path, offset, chunk_size, digest):
+            cursor.execute("BEGIN")
+            try:
+                inserted, updated, skipped = _sync_chunk(cursor, chunk)
+                cursor.execute("""
+                INSERT INTO csv_sync_state (csv_path, header, byte_offset, prefix_hash) VALUES (?, ?, ?, ?)
+                ON CONFLICT(csv_path) DO UPDATE SET header = excluded.header, byte_offset = excluded.byte_offset,
+                    prefix_hash = excluded.prefix_hash
+                """, (path, header, end_offset, digest.hexdigest()))
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+            counts['skipped'] += skipped
+
+        print(f"Synced {csv_file_path}: {counts['inserted']} inserted, "
+              f"{counts['updated']} updated, {counts['skipped']} skipped")
+
+    except sqlite3.IntegrityError as e:
+        print(f"Error syncing data, user_data has duplicate emails: {e}")
+    except sqlite3.Error as e:
+        print(f"Error syncing data: {e}")
+    except Exception as e:
+        print(f"Error reading CSV file: {e}")
+    finally:
+        cursor.close()
+        connection.isolation_level = isolation_level
+    return counts
+
+FIRST_NAMES = (
+    'Alice', 'Alma', 'Bob', 'Charlie', 'Dan', 'Daniel', 'Delia', 'Diana', 'Frank', 'Glenda',
+    'Grace', 'Henry', 'Ivy', 'Jack', 'Jane', 'John', 'Kate', 'Miriam', 'Molly', 'Ronnie',
+    'Sandra', 'Shelly', 'Tom', 'Uma', 'Victor', 'Wanda', 'Xavier', 'Yara', 'Zane', 'Zoe',
+)
+
+LAST_NAMES = (
+    'Altenwerth', 'Anderson', 'Balistreri', 'Bechtelar', 'Brown', 'Cartwright', 'Clark', 'Davis',
+    'Doe', 'Fahey', 'Johnson', 'Lesch', 'Miller', 'Smith', 'Taylor', 'Wilson', 'Wisozk', 'Young',
+)
+
+# email domain -> relative weight
+EMAIL_DOMAINS = {
+    'gmail.com': 50,
+    'yahoo.com': 20,
+    'hotmail.com': 20,
+    'email.com': 10,
+}
+
+# rows per shard; every shard has its own random stream derived from the seed,
+# so the output does not depend on how many workers produced it
+SYNTHETIC_SHARD_SIZE = 100000
+
+def generate_user_shard(shard, count, seed=0, shard_size=SYNTHETIC_SHARD_SIZE,
+                        age_distribution='uniform', age_range=(18, 100), age_mean=40, age_stddev=12,
+                        domains=None, duplicate_rate=0.0) -> List[Tuple[str, str, str, int]]:
+    """
+    Generate shard number `shard` of a synthetic data set of `count`
+    users as (user_id, name, email, age) rows.
+
+    age_distribution is 'uniform' over age_range or 'normal' around
+    age_mean, clipped to age_range. domains maps email domains to
+    weights. duplicate_rate is the share of rows that reuse the email of
+    an earlier row in the same shard.
+    """
+    start = shard * shard_size
+    size = max(0, min(shard_size, count - start))
+    rng = random.Random(f"{seed}:{shard}")
+    domains = domains or EMAIL_DOMAINS
+
+    first_names = rng.choices(FIRST_NAMES, k=size)
+    last_names = rng.choices(LAST_NAMES, k=size)
+    email_domains = rng.choices(list(domains), weights=list(domains.values()), k=size)
+
+    low, high = age_range
+    if age_distribution == 'uniform':
+        ages = rng.choices(range(low, high + 1), k=size)
+    elif age_distribution == 'normal':
+        ages = [min(high, max(low, round(rng.gauss(age_mean, age_stddev)))) for _ in range(size)]
+    else:
+        raise ValueError(f"Unknown age distribution: {age_distribution}")
+
+    rows = []
+    emails = []
+    for i in range(size):
+        first, last = first_names[i], last_names[i]
+        if duplicate_rate and i and rng.random() < duplicate_rate:
+            email = emails[rng.randrange(i)]
+        else:
+            email = f"{first}.{last}{start + i}@{email_domains[i]}"
+        emails.append(email)
+        # same layout as str(uuid.UUID(int=..., version=4)), at half the cost
+        bits = '%032x' % rng.getrandbits(128)
+        user_id = f"{bits[:8]}-{bits[8:12]}-4{bits[13:16]}-{'89ab'[int(bits[16], 16) & 3]}{bits[17:20]}-{bits[20:]}"
+        rows.append((user_id, f"{first} {last}", email, ages[i]))
+    return rows
+
+def _generate_user_shard(task):
+    shard, count, seed, options = task
+    return generate_user_shard(shard, count, seed, **options)
+
+def _write_user_shard(path, shard, count, seed, options):
+    rows = generate_user_shard(shard, count, seed, **options)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['name', 'email', 'age'])
+        writer.writerows(row[1:] for row in rows)
+    return len(rows)
+
+def _shard_count(count, shard_size):
+    return -(-count // shard_size)
+
+def _bounded_map(executor, func, tasks, limit):
+    """
+    Like executor.map(func, tasks) in order, but with at most `limit`
+    tasks submitted and not yet consumed, so finished results can't
+    pile up faster than the caller uses them
+    """
+    tasks = iter(tasks)
+    pending = deque(executor.submit(func, task) for task in islice(tasks, limit))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for task in islice(tasks, 1):
+                pending.append(executor.submit(func, task))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+def seed_synthetic_users(connection, count, seed=0, workers=None, **options):
+    """
+    Insert `count` deterministic synthetic users straight into user_data.
+
+    Shards are generated in parallel by worker processes and inserted in
+    shard order, one transaction each. The same seed and options always
+    produce the same rows, user_id included. Extra keyword arguments are
+    passed to generate_user_shard. Returns the number of rows inserted.
+    """
+    shard_size = options.get('shard_size', SYNTHETIC_SHARD_SIZE)
+    shards = range(_shard_count(count, shard_size))
+
+    workers = workers or os.cpu_count() or 1
+
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    previous = set_pragmas(connection, BULK_LOAD_PRAGMAS)
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tasks = ((shard, count, seed, options) for shard in shards)
+            # the inserter is single threaded, only keep a few shards ahead of it
+            chunks = _bounded_map(executor, _generate_user_shard, tasks, 2 * workers)
+            inserted = bulk_insert_rows(connection, chunks, generate_ids=False)
+    finally:
+        connection.execute(f"PRAGMA synchronous = {previous['synchronous']}")
+        connection.isolation_level = isolation_level
+
+    elapsed = time.perf_counter() - start
+    rate = inserted / elapsed if elapsed else 0
+    print(f"Generated {inserted} synthetic users in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return inserted
+
+def write_synthetic_csv(directory, count, seed=0, workers=None, **options) -> List[str]:
+    """
+    Write `count` deterministic synthetic users as sharded CSV files
+    (users-00000.csv, ...) in the same name,email,age format as
+    user_data.csv. Each worker writes its own shards. Returns the paths.
+    """
+    shard_size = options.get('shard_size', SYNTHETIC_SHARD_SIZE)
+    shards = range(_shard_count(count, shard_size))
+    paths = [os.path.join(directory, f"users-{shard:05d}.csv") for shard in shards]
+    os.makedirs(directory, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        written = sum(executor.map(_write_user_shard, paths, shards, [count] * len(shards),
+                                   [seed] * len(shards), [options] * len(shards)))
+
+    print(f"Wrote {written} synthetic users to {len(paths)} CSV files in {directory}")
+    return paths
+
 def create_sample_csv():        
     
     sample_data = [
@@ -110,6 +842,121 @@ def create_sample_csv():
         
     print("Sample user_data.csv created successfully")   
         
+def build_user_query(columns=None, where=None):
+    """
+    Compile a projection and filter spec into a SELECT on user_data.
+
+    columns is a sequence of column names (all columns when None) and
+    where a sequence of (column, operator, value) tuples joined with AND,
+    e.g. [('age', '>', 25)]. Names are checked against USER_COLUMNS and
+    values are always bound as parameters. Returns (query, params).
+    """
+    columns = tuple(columns) if columns else USER_COLUMNS
+    for column in columns:
+        if column not in USER_COLUMNS:
+            raise ValueError(f"Unknown column: {column}")
+
+    clauses = []
+    params = []
+    for column, op, value in where or ():
+        op = op.upper()
+        if column not in USER_COLUMNS + FILTER_ONLY_COLUMNS:
+            raise ValueError(f"Unknown column: {column}")
+        if op not in SQL_OPERATORS:
+            raise ValueError(f"Unsupported operator: {op}")
+        if op == 'IN':
+            values = list(value)
+            if not values:
+                # nothing can match an empty IN list
+                clauses.append("0")
+                continue
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        else:
+            clauses.append(f"{column} {op} ?")
+            params.append(value)
+
+    query = f"SELECT {', '.join(columns)} FROM user_data"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    return query, tuple(params)
+
+# index name -> indexed columns, matching the access patterns of the generators
+TUNING_INDEXES = {
+    # stream_user_ages and aggregate_ages read only age,
+    # lazy_paginate(sort_key='age') seeks on (age, user_id)
+    'idx_user_data_age': ('age', 'user_id'),
+    # batch_processing: name, email, age of users with age > 25
+    'idx_user_data_age_name_email': ('age', 'name', 'email'),
+}
+
+def tune_schema(connection):
+    """
+    Drop the redundant idx_user_id index and create the covering indexes
+    in TUNING_INDEXES. Creating them after a bulk load is much faster
+    than maintaining them during it.
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("DROP INDEX IF EXISTS idx_user_id")
+        for name, columns in TUNING_INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON user_data({', '.join(columns)})")
+        # refresh the planner statistics for the new indexes
+        cursor.execute("PRAGMA optimize")
+        connection.commit()
+        cursor.close()
+        print("Schema tuned for the generator queries")
+
+    except sqlite3.Error as e:
+        print(f"Error tuning schema: {e}")
+
+# the queries the generator scripts run, as (query, params, full scan expected)
+GENERATOR_QUERIES = {
+    'stream_users': ("SELECT * FROM user_data", (), True),
+    'stream_users_in_batches': build_user_query(None, None) + (True,),
+    'batch_processing': build_user_query(('name', 'email', 'age'), [('age', '>', 25)]) + (False,),
+    'lazy_paginate': ("SELECT * FROM user_data WHERE user_id > ? ORDER BY user_id LIMIT ?", ('', 100), False),
+    'lazy_paginate_by_age': (
+        "SELECT * FROM user_data WHERE (age, user_id) > (?, ?) ORDER BY age, user_id LIMIT ?", (25, '', 100), False
+    ),
+    'stream_users_checkpointed': ("SELECT * FROM user_data WHERE user_id > ? ORDER BY user_id", ('',), False),
+    'stream_user_ages': ("SELECT age FROM user_data", (), False),
+    'aggregate_ages': ("SELECT age, COUNT(*) FROM user_data GROUP BY age ORDER BY age", (), False),
+    'parallel_scan': build_user_query(None, [('rowid', '>=', 1), ('rowid', '<=', 1000)]) + (False,),
+}
+
+def audit_query_plans(connection, queries=None):
+    """
+    Run EXPLAIN QUERY PLAN on every generator query and flag full scans
+    and temporary sort trees. A scan through an index that isn't covering
+    still visits every row, plus a table lookup per row, so only scans of
+    a covering index pass, and scans of queries that stream the whole
+    table by design. Returns a list of dicts, one per query.
+    """
+    report = []
+    for name, (query, params, full_scan_expected) in (queries or GENERATOR_QUERIES).items():
+        try:
+            plan = [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        except sqlite3.Error as e:
+            print(f"Error explaining {name}: {e}")
+            continue
+
+        table_scan = any(step.startswith('SCAN') and 'USING COVERING INDEX' not in step for step in plan)
+        temp_sort = any('TEMP B-TREE' in step for step in plan)
+        flagged = temp_sort or (table_scan and not full_scan_expected)
+
+        report.append({
+            'name': name,
+            'query': query,
+            'plan': plan,
+            'full_table_scan': table_scan,
+            'temp_b_tree': temp_sort,
+            'flagged': flagged,
+        })
+        print(f"{'FLAG' if flagged else 'ok':<5} {name:<26} {' | '.join(plan)}")
+
+    return report
+
 def stream_users_from_db(connection) -> Generator[Dict[str, Any], None, None]:
     try:
         #Sets row factory to return rows as dictionaries
@@ -142,7 +989,9 @@ def main():
     
     create_table(connection)
     
-    insert_data(connection, 'user_data.csv')
+    bulk_insert_data(connection, 'user_data.csv')
+    
+    tune_schema(connection)
     
     for i, user in enumerate(stream_users_from_db(connection), 1):
         print(f"User {i}: {user}")